@@ -7,7 +7,15 @@ from spacegame.geometry import *
 from spacegame.vectors import Vector
 from spacegame.assets import *
 from spacegame.ui import Anchor, BitmapFont
-from spacegame.core import resource
+from spacegame.core import Display
+from spacegame.loader import Loader
+from spacegame.spatial import SpatialGrid
+from spacegame.profiler import Profiler
+
+try:
+    from spacegame.particles import ParticleSystem
+except ImportError:
+    ParticleSystem = None
 
 
 __all__ = [
@@ -21,13 +29,58 @@ class Actor(Polygon):
 
     """Base class for all in-game objects."""
 
-    # NOTE: do not set __slots__, it will cause problems with the update method.
-
     def __init__(self, refpoints):
         super(Actor, self).__init__(Vector.zero(), 0.0, Vector.one(), refpoints)
         self.motion = Vector.zero()
         self.command = None
         self.paths = {}
+        self.animator = None
+
+    # the attributes kept by get_data, besides the refpoints and the path animations
+    # (see streaming); subclasses with more state to keep extend it
+    data = ("position", "rotation", "scale", "motion", "fillcolor", "linecolor", "cached_render")
+
+    # the attributes get_data leaves out: kept apart, rebuilt, or set by the room
+    transient = ("refpoints", "paths", "animator", "command", "points", "draw_points")
+
+    def get_data(self) -> dict:
+        """Returns the state of this actor as plain data (numbers, strings and tuples),
+        and its path animations (see PathState.get_data).
+
+        Raises TypeError if the actor has attributes that aren't in 'data', as
+        they'd be lost."""
+        unknown = [name for name in vars(self) if name not in self.data and name not in Actor.transient]
+        if unknown:
+            raise TypeError("{} has state get_data doesn't keep: {} (see Actor.data).".format(
+                type(self).__qualname__, ", ".join(unknown)))
+
+        data = {"refpoints": tuple(tuple(point) for point in self.refpoints),
+                "paths": tuple(pathstate.get_data() for pathstate in self.paths.values())}
+        for name in self.data:
+            if hasattr(self, name):
+                value = getattr(self, name)
+                data[name] = value.xy if isinstance(value, Vector) else value
+        return data
+
+    @classmethod
+    def from_data(cls, data: dict) -> 'Actor':
+        """Returns a new actor of this class with the state returned by get_data.
+
+        The subclass constructor isn't called. The path animations are
+        registered when the actor is added to a room."""
+        actor = cls.__new__(cls)
+        Actor.__init__(actor, list(data["refpoints"]))
+        for name in cls.data:
+            if name in data:
+                value = getattr(actor, name, None)
+                if isinstance(value, Vector):
+                    value.xy = data[name]
+                else:
+                    setattr(actor, name, data[name])
+        for state in data.get("paths", ()):
+            pathstate = PathState.from_data(state)
+            actor.paths[pathstate.attr] = pathstate
+        return actor
 
     def set_path(self, attribute: str, path: Path, asgnmode: AssignMode, repeats: int=-1, ratio: float=0.0) -> None:
         """Adds or removes a animation path for an attribute."""
@@ -36,11 +89,15 @@ class Actor(Polygon):
                 del self.paths[attribute]
             except KeyError:
                 pass
+            if self.animator is not None:
+                self.animator.remove(self, attribute)
         elif isinstance(path, Path):
             pth = PathState(attribute, asgnmode, path)
             pth.counter = repeats
             pth.ratio = ratio
             self.paths[attribute] = pth
+            if self.animator is not None:
+                self.animator.add(self, pth)
         else:
             raise TypeError("'path' argument is not a Path subclass.")
 
@@ -52,25 +109,19 @@ class Actor(Polygon):
         """apply motion to this object."""
         self.motion += lengthdir(length, angle)
 
-    def animate(self, game: type) -> None:
-        """Updates animation attributes."""
-
-        # check for animations
-        for name in self.__dict__:
-            if name in self.paths:
-                pathstate = self.paths[name]
-                if pathstate.is_animating:
-                    ended = pathstate.animate()
-                    if pathstate.asgnmode is AssignMode.direct_value:
-                        setattr(self, name, pathstate.position)
-                    elif pathstate.asgnmode is AssignMode.vector_updt:
-                        getattr(self, name).xy = pathstate.position
-                    if ended:
-                        self.on_animation_end(name, pathstate, game)
+    def animate(self, game: type, room: 'Room'=None, seconds: float=None) -> None:
+        """Updates animation attributes.
 
-            else:
-                if name == 'position':
-                    self.motion_update()
+        Actors added to a room are animated by the room's animator instead."""
+        for name, pathstate in list(self.paths.items()):
+            if pathstate.is_animating:
+                ended = pathstate.animate(seconds)
+                if pathstate.asgnmode is AssignMode.direct_value:
+                    setattr(self, name, pathstate.position)
+                elif pathstate.asgnmode is AssignMode.vector_updt:
+                    getattr(self, name).xy = pathstate.position
+                if ended:
+                    self.on_animation_end(name, pathstate, game, room)
 
     def on_initialize(self) -> None:
         """Called in the instance creation."""
@@ -138,7 +189,10 @@ class View(Polygon):
 
     refpoints = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
     transition = Path1d([0.75 ** i for i in range(20)])
-    starfield = pygame.image.load(resource("starfield.png"))
+    starfield = Loader.handle("starfield")
+
+    # pixels of the render target per world unit (see Display.set_scale)
+    zoom = 1.0
 
     def __init__(self, room: 'Room'):
         super(View, self).__init__(Vector.zero(), 0.0, Vector(*self.size), View.refpoints)
@@ -146,15 +200,19 @@ class View(Polygon):
         self.room = room
         self.anchor = Anchor.top_left
         self.paths = {}
+        self.animator = room.animator
         self.set_path('transition', View.transition, AssignMode.direct_value, 0)
-        self.parallaxes = [
-            BackScroller(View.starfield, self.size, [77, 14]),
-            BackScroller(View.starfield, self.size, [28, 56]),
-        ]
+        self.parallax = ParallaxLayers([
+            BackScroller(View.starfield.get(), self.size, [77, 14]),
+            BackScroller(View.starfield.get(), self.size, [28, 56]),
+        ], c.BLEND_ADD)
+        self.parallaxes = self.parallax.layers
+        self.blits = 0
 
     @property
     def size(self) -> tuple:
-        return pygame.display.get_surface().get_size()
+        """Gets the size of the visible area, in world units (the window size)."""
+        return Display.size()
 
     def rel_point(self, point: tuple) -> Vector:
         x, y = self.position
@@ -194,11 +252,15 @@ class View(Polygon):
                 del self.paths[attribute]
             except KeyError:
                 pass
+            if self.animator is not None:
+                self.animator.remove(self, attribute)
         elif isinstance(path, Path):
             pth = PathState(attribute, asgnmode, path)
             pth.counter = repeats
             pth.ratio = ratio
             self.paths[attribute] = pth
+            if self.animator is not None:
+                self.animator.add(self, pth)
         else:
             raise TypeError("'path' argument is not a Path subclass.")
 
@@ -209,38 +271,71 @@ class View(Polygon):
         super(View, self).translate(motion)
 
     def animate(self, game: type) -> None:
-        """Updates animation attributes."""
-        motion = self.motion * 1.0
-        # check for animations
-        for name in self.__dict__:
-            if name not in self.paths:
-                continue
-
-            pathstate = self.paths[name]
-
-            if pathstate.is_animating:
-                ended = pathstate.animate()
-                if pathstate.asgnmode is AssignMode.direct_value:
-                    setattr(self, name, pathstate.position)
-                elif pathstate.asgnmode is AssignMode.vector_updt:
-                    getattr(self, name).xy = pathstate.position
-                if ended:
-                    self.on_animation_end(name, pathstate, game, self.room)
+        """Updates the parallax scrolling.
 
-        for parallax in self.parallaxes:
-            motion *= 0.75
-            parallax.update(motion)
+        The view's paths are animated by the room's animator."""
+        self.zoom = Display.zoom()
+        self.parallax.update(self.motion)
 
     def on_animation_end(self, attr: str, pathstate: PathState, game: type, room: 'Room'):
         pass
 
-    def render(self, surface: pygame.Surface) -> None:
-        for parallax in self.parallaxes:
-            parallax.render(surface, c.BLEND_ADD)
+    def render(self, surface: pygame.Surface) -> int:
+        """Draws the parallax background and returns the number of blits it took.
+
+        The surface is the render target, sized by the view's zoom."""
+        size = Display.target().get_size()
+        if size != self.parallax.size or self.zoom != self.parallax.zoom:
+            self.parallax.resize(size, self.zoom)
+
+        self.blits = self.parallax.render(surface)
+        Display.mark(surface, ((0, 0), size))
+        return self.blits
 
 
 class Room(object):
 
+    """The actors of a scene, updated and drawn together.
+
+    The event hooks are only called on the actors whose class overrides them:
+    when actors are added, their bound hooks are appended to the 'subscribers'
+    list of each hook, so an event no actor listens to costs nothing."""
+
+    # the hooks routed through the subscribers lists
+    HOOKS = (
+        "on_command",
+        "on_keyup",
+        "on_keydown",
+        "on_mouse_move",
+        "on_left_click",
+        "on_middle_click",
+        "on_right_click",
+        "on_roll_up",
+        "on_roll_down",
+        "on_prerender",
+    )
+
+    # the hooks of each mouse button
+    CLICKS = {
+        1: "on_left_click",
+        2: "on_middle_click",
+        3: "on_right_click",
+        4: "on_roll_up",
+        5: "on_roll_down",
+    }
+
+    # the hooks overridden by each actor class
+    _overrides = {}
+
+    @classmethod
+    def get_hooks(cls, actor_class: type) -> tuple:
+        """Returns the hooks the actor class overrides, looked up once per class."""
+        hooks = cls._overrides.get(actor_class)
+        if hooks is None:
+            hooks = cls._overrides[actor_class] = tuple(
+                hook for hook in cls.HOOKS if getattr(actor_class, hook) is not getattr(Actor, hook))
+        return hooks
+
     @classmethod
     def get_command(cls, event) -> tuple or None:
         if event.type == c.KEYDOWN:
@@ -270,90 +365,186 @@ class Room(object):
     def __init__(self, actors: list):
         self.actors = []
         self.visible = []
+        self.grid = SpatialGrid()
+        self._visible = set()
+        self._order = {}
+        self._serial = 0
+        self.subscribers = {hook: [] for hook in Room.HOOKS}
         self.minimum = Vector.zero()
         self.maximum = Vector.one()
+        self.animator = Animator()
+        self.particles = ParticleSystem() if ParticleSystem is not None else None
+        self.streamer = None
+        self.debug_text = None
         self.view = View(self)
         self.add_actors(actors)
 
     def add_actors(self, actors: list) -> None:
+        added = {}
         for actor in actors:
-            if actor not in self.actors:
+            if actor not in self._order:
                 self.actors.append(actor)
+                actor.animator = self.animator
+                self.animator.add_object(actor)
+                self.grid.insert(actor, actor.get_bounds())
+                self._order[actor] = self._serial
+                self._serial += 1
+                for hook in Room.get_hooks(type(actor)):
+                    added.setdefault(hook, []).append(getattr(actor, hook))
+
+        # new lists, so the hooks can add actors while the old ones are iterated
+        for hook, methods in added.items():
+            self.subscribers[hook] = self.subscribers[hook] + methods
+
+    def remove_actors(self, actors: list) -> None:
+        removed = set()
+        for actor in actors:
+            if actor in self._order:
+                self.animator.remove_object(actor)
+                actor.animator = None
+                self.grid.remove(actor)
+                del self._order[actor]
+                removed.add(actor)
+
+        if removed:
+            self.actors[:] = [actor for actor in self.actors if actor not in removed]
+            self.visible[:] = [actor for actor in self.visible if actor not in removed]
+            self._visible -= removed
+            for hook, methods in self.subscribers.items():
+                if methods:
+                    self.subscribers[hook] = [method for method in methods if method.__self__ not in removed]
 
     def clear(self) -> None:
-        del self.actors[:]
+        for actor in self.actors:
+            self.animator.remove_object(actor)
+            actor.animator = None
+        del self.actors[:], self.visible[:]
+        self.grid.clear()
+        self._visible.clear()
+        self._order.clear()
+        self.subscribers = {hook: [] for hook in Room.HOOKS}
+        if self.particles is not None:
+            self.particles.clear()
 
     def update(self, events: list, keys: tuple, view: 'View', game: type) -> None:
         """Updates all objects."""
-        indices = range(len(self.actors))
+        # chunks near the view are loaded and distant ones unloaded, before anything is updated
+        if self.streamer is not None:
+            self.streamer.update(view)
+            Profiler.mark("streaming")
 
-        # events
+        subscribers = self.subscribers
+
+        # events, to the actors subscribed to them
         for event in events:
             if event.type == c.KEYDOWN:
-                cmd = Room.get_command(event)
-                for i in indices:
-                    self.actors[i].on_command(cmd, game, self)
+                if subscribers["on_command"]:
+                    cmd = Room.get_command(event)
+                    for on_command in subscribers["on_command"]:
+                        on_command(cmd, game, self)
 
             elif event.type == c.KEYUP:
-                for i in indices:
-                    self.actors[i].on_keyup(event.key, game, self)
+                for on_keyup in subscribers["on_keyup"]:
+                    on_keyup(event.key, game, self)
 
             elif event.type == c.MOUSEMOTION:
-                rpos = Vector(*event.pos)
-                apos = self.view.abs_point(event.pos)
-                rel = Vector(*event.rel)
-                for i in indices:
-                    self.actors[i].on_mouse_move(apos, rpos, rel, game, self)
+                if subscribers["on_mouse_move"]:
+                    rpos = Vector(*event.pos)
+                    apos = self.view.abs_point(event.pos)
+                    rel = Vector(*event.rel)
+                    for on_mouse_move in subscribers["on_mouse_move"]:
+                        on_mouse_move(apos, rpos, rel, game, self)
 
             elif event.type == c.MOUSEBUTTONDOWN:
-                rpos = Vector(*event.pos)
-                apos = self.view.abs_point(event.pos)
-                for i in indices:
-                    {
-                        1: self.actors[i].on_left_click,
-                        2: self.actors[i].on_middle_click,
-                        3: self.actors[i].on_right_click,
-                        4: self.actors[i].on_roll_up,
-                        5: self.actors[i].on_roll_down,
-                    }[event.button](apos, rpos, game, self)
-
-        # motion
+                hook = Room.CLICKS.get(event.button)
+                if hook is not None and subscribers[hook]:
+                    rpos = Vector(*event.pos)
+                    apos = self.view.abs_point(event.pos)
+                    for on_click in subscribers[hook]:
+                        on_click(apos, rpos, game, self)
+
+        for on_keydown in self.subscribers["on_keydown"]:
+            on_keydown(keys, game, self)
+        Profiler.mark("events")
+
+        # animation
+        seconds = Display.clock.get_time() / 1000.0
         self.view.animate(game)
-        for i in indices:
-            self.actors[i].on_keydown(keys, game, self)
-            self.actors[i].animate(game)
-            self.actors[i].update(view)
+        Profiler.mark("view")
+        self.animator.step(game, self, seconds)
+        if self.particles is not None:
+            self.particles.update(seconds)
+        Profiler.mark("animate")
+
+        # motion, of the actors in the room after the hooks; the hooks from here on
+        # may remove actors, which are skipped once they're out of the room
+        actors = list(self.actors)
+        order = self._order
+        for actor in actors:
+            if actor not in order:
+                continue
+            if 'position' not in actor.paths:
+                actor.motion_update()
+            actor.update(view)
+            self.grid.update(actor, actor.get_bounds())
+        Profiler.mark("motion")
 
         # collision
-        for j in indices:
-            a = self.actors[j]
-            for k in indices[j + 1:]:
-                b = self.actors[k]
+        info = None
+        count = len(actors)
+        for j in range(count):
+            a = actors[j]
+            if a not in order:
+                continue
+            for k in range(j + 1, count):
+                b = actors[k]
+                if b not in order:
+                    continue
 
                 info = a.collide_with(b)
-                BitmapFont.set_colors(BitmapFont.small, (0, 0, 0), (255, 255, 255))
-                BitmapFont.render(
-                    pygame.display.get_surface(),
-                    "{}".format(list(info.values())),
-                    BitmapFont.small,
-                    Vector(0, 300)
-                )
-
                 if info[SAT.overlapped]:
                     a.on_collision(b, info, game, self)
                     b.on_collision(a, info, game, self)
+                    if a not in order:
+                        break
+
+        # the debug text of the last pair tested, drawn by render_debug
+        self.debug_text = "{}".format(list(info.values())) if info is not None else None
+
+        Profiler.mark("collision")
 
         # select visible
-        for actor in self.actors:
-            info = self.view.collide_with(actor)
-            if info[SAT.overlapped]:
-                if actor not in self.visible:
-                    self.visible.append(actor)
-                    actor.on_enter_view(self.view, game, self)
-            else:
-                if actor in self.visible:
-                    self.visible.remove(actor)
-                    actor.on_leave_view(self.view, game, self)
+        self.update_visible(game)
+        Profiler.mark("visibility")
 
-        for actor in self.actors:
-            actor.on_prerender(game, self)
\ No newline at end of file
+        for on_prerender in self.subscribers["on_prerender"]:
+            on_prerender(game, self)
+        Profiler.mark("prerender")
+
+    def render_debug(self, surface) -> None:
+        """Draws the collision debug text onto the surface (or records it, for a RenderQueue).
+
+        It changes every frame, so it would only churn the text cache."""
+        if self.debug_text is not None:
+            BitmapFont.set_colors(BitmapFont.small, (0, 0, 0), (255, 255, 255))
+            BitmapFont.render(surface, self.debug_text, BitmapFont.small, Vector(0, 300), cached=False)
+
+    def update_visible(self, game: type) -> None:
+        """Updates the list of actors inside the view area, in the order they were added.
+
+        Only the actors found by the spatial grid in the view area are tested."""
+        x, y = self.view.position
+        w, h = self.view.size
+        visible = self.grid.query((x, y, x + w, y + h))
+        previous = self._visible
+        if visible == previous:
+            return
+
+        self._visible = visible
+        self.visible[:] = sorted(visible, key=self._order.__getitem__)
+
+        for actor in previous - visible:
+            actor.on_leave_view(self.view, game, self)
+
+        for actor in visible - previous:
+            actor.on_enter_view(self.view, game, self)
\ No newline at end of file
@@ -2,12 +2,18 @@ __author__ = 'Jorge'
 
 
 from enum import Enum
+from bisect import bisect_right
+from collections import OrderedDict
+import threading
 import pygame
 import pygame.gfxdraw
 import math
 from spacegame.geometry import *
 from spacegame.vectors import Vector
 from spacegame.ui import blend_color
+from spacegame.easing import Easing
+from spacegame.core import Display
+from spacegame.renderer import draw
 from spacegame.sat import *
 # from spacegame.core import resource
 
@@ -16,15 +22,23 @@ __all__ = [
     "SAT",
     "SAT_NO_COLLISION",
     "PathState",
+    "PathTable",
+    "PathBaker",
+    "Animator",
     "Path",
     "Path1d",
     "Path2d",
     "PathTone",
     "PathCircle",
+    "PathSpline",
+    "PathCatmullRom",
+    "PathBezier",
     "Parallax",
     "BackScroller",
+    "ParallaxLayers",
     "Polygon",
-    "Circle"
+    "Circle",
+    "SpriteCache"
 ]
 
 
@@ -45,6 +59,9 @@ SAT_NO_COLLISION = {SAT.overlapped: False, SAT.sep_axis: None, SAT.face_normal:
 
 class Path(object):
 
+    # whether the path loops back to its start, so ratios past its ends wrap around
+    closed = False
+
     def get_position(self, ratio: float) -> None:
         raise NotImplementedError("{} subclass method should be called.".format(self.__class__.__name__))
 
@@ -54,69 +71,104 @@ class Path(object):
     def get_ratio(self, length: float) -> None:
         raise NotImplementedError("{} subclass method should be called.".format(self.__class__.__name__))
 
+    def update(self) -> None:
+        """Discards the baked samples of this path.
+
+        Must be called after the path is changed in place."""
+        PathBaker.discard(self)
+
 
 class Path1d(Path):
 
-    __slots__ = ("values", "closed")
+    __slots__ = ("_values", "_closed", "offsets")
 
     def __init__(self, values, closed: bool=False):
-        self.values = values
-        self.closed = closed
+        self._values = values
+        self._closed = closed
+        self.offsets = []
+        self.update()
+
+    @property
+    def values(self) -> list:
+        """Gets or sets the values of this path."""
+        return self._values
+
+    @values.setter
+    def values(self, value) -> None:
+        self._values = value
+        self.update()
+
+    @property
+    def closed(self) -> bool:
+        """Gets or sets whether this path loops back to its first value."""
+        return self._closed
+
+    @closed.setter
+    def closed(self, value) -> None:
+        self._closed = value
+        self.update()
 
     @property
     def length(self) -> float:
         """Gets the length of this path."""
-        if len(self.values) in (0, 1):
-            return 0.0
+        return self.offsets[-1]
+
+    def update(self) -> float:
+        """Calculates, stores and returns length of this path.
+
+        Must be called after the values list is changed in place."""
+        super(Path1d, self).update()
+        values = self._values
+        offsets = self.offsets
+        del offsets[:]
+        offsets.append(0.0)
 
-        length = 0
-        for i in range(1, len(self.values)):
-            length += abs(self.values[i] - self.values[i - 1])
+        length = 0.0
+        if len(values) > 1:
+            for i in range(1, len(values)):
+                length += abs(values[i] - values[i - 1])
+                offsets.append(length)
 
-        if self.closed:
-            length += abs(self.values[0] - self.values[-1])
+            if self._closed:
+                length += abs(values[0] - values[-1])
+                offsets.append(length)
 
         return length
 
     def get_position(self, ratio: float) -> float:
         """Returns a position in the path relative to the ratio of its length."""
+        values = self._values
 
-        if len(self.values) == 0:
+        if len(values) == 0:
             raise ValueError("Path contains no values.")
 
-        if len(self.values) == 1:
-            return self.values[0]
+        if len(values) == 1:
+            return values[0]
 
-        if self.length == 0.0:
-            return self.values[0]
+        offsets = self.offsets
+        total = offsets[-1]
 
-        if ratio == 0.0 or (self.closed and ratio == 1.0):
-            return self.values[0]
+        if total == 0.0:
+            return values[0]
+
+        if ratio == 0.0 or (self._closed and ratio == 1.0):
+            return values[0]
 
         if ratio == 1.0:
-            return self.values[-1]
+            return values[-1]
 
         ratio %= 1.0
-        size = len(self.values)
-        total = self.length
         limit = total * ratio
-        after = 0
-        before = 0
-        i = 0
-        d = 0
-        while after < limit:
-            a = self.values[i]
-            b = self.values[(i + 1) % size]
-            d = abs(b - a)
-            before = after
-            after += d
-            i += 1
-
-        assert before <= limit <= after
 
-        r = float(after - limit) / d
+        # index of the segment end: offsets[i - 1] <= limit < offsets[i], past any zero-length
+        # segment; only the last one can be reached (when limit rounds up to the total)
+        i = min(bisect_right(offsets, limit), len(offsets) - 1)
+        span = offsets[i] - offsets[i - 1]
+        if span == 0.0:
+            return values[i - 1]
+        r = float(offsets[i] - limit) / span
 
-        return lerp1d(self.values[i], self.values[i-1], r)
+        return lerp1d(values[i % len(values)], values[i - 1], r)
 
     def get_length(self, ratio: float) -> float:
         """Returns a path length relative to given ratio."""
@@ -140,59 +192,94 @@ class Path1d(Path):
 
 class Path2d(Path):
 
-    __slots__ = ("points", "closed", "lengths")
+    __slots__ = ("_points", "_closed", "lengths", "offsets")
 
     def __init__(self, points, closed: bool=False):
-        self.points = points
-        self.closed = closed
+        self._points = points
+        self._closed = closed
         self.lengths = []
+        self.offsets = []
+        self.update()
+
+    @property
+    def points(self) -> list:
+        """Gets or sets the points of this path."""
+        return self._points
+
+    @points.setter
+    def points(self, value) -> None:
+        self._points = value
+        self.update()
+
+    @property
+    def closed(self) -> bool:
+        """Gets or sets whether this path loops back to its first point."""
+        return self._closed
+
+    @closed.setter
+    def closed(self, value) -> None:
+        self._closed = value
         self.update()
 
     @property
     def length(self) -> float:
         """Gets the length of this path"""
-        return sum(self.lengths)
+        return self.offsets[-1]
 
     def update(self) -> float:
-        """Calculates, stores and returns length of this path."""
+        """Calculates, stores and returns length of this path.
+
+        Must be called after the points list is changed in place."""
+        super(Path2d, self).update()
+        points = self._points
         del self.lengths[:]
-        _len = len(self.points)
+        del self.offsets[:]
+        self.offsets.append(0.0)
+
+        _len = len(points)
         if _len > 1:
             for i in range(_len - 1):
-                self.lengths.append(distance(self.points[i], self.points[i + 1]))
+                self.lengths.append(distance(points[i], points[i + 1]))
+
+            if self._closed:
+                self.lengths.append(distance(points[0], points[-1]))
 
-            if self.closed:
-                self.lengths.append(distance(self.points[0], self.points[-1]))
+            length = 0.0
+            for d in self.lengths:
+                length += d
+                self.offsets.append(length)
 
-            return sum(self.lengths)
+            return length
 
         return 0.0
 
     def get_position(self, ratio: float) -> tuple:
         """Returns a position in the path relative to the ratio of its length."""
-        ratio %= 1.0
+        points = self._points
+        offsets = self.offsets
+        total = offsets[-1]
 
-        if self.length == 0:
+        if total == 0:
             return 0.0, 0.0
 
-        if ratio == 0.0 or (self.closed and ratio == 1.0):
-            return self.points[0]
+        if ratio == 0.0 or (self._closed and ratio == 1.0):
+            return points[0]
 
         if ratio == 1.0:
-            return self.points[-1]
-
-        if len(self.points) > 1:
-            limit = self.length * ratio
-            dist = 0
-            pts = self.closed and self.points[:-1] or self.points[:]
-            for i, d in enumerate(pts):
-                j = (i + 1) % len(self.points)
-                if dist <= limit < dist + self.lengths[i]:
-                    rem = limit - dist
-                    ratio2 = rem / self.lengths[i]
-                    # print(pts[i], pts[j])
-                    return lerp2d(pts[i], pts[j], ratio2)
-                dist += self.lengths[i]
+            return points[-1]
+
+        ratio %= 1.0
+        limit = total * ratio
+
+        # index of the segment end: offsets[i - 1] <= limit < offsets[i], past any zero-length
+        # segment; only the last one can be reached (when limit rounds up to the total)
+        i = min(bisect_right(offsets, limit), len(offsets) - 1)
+        span = self.lengths[i - 1]
+        if span == 0.0:
+            return points[i - 1]
+        ratio2 = (limit - offsets[i - 1]) / span
+
+        return lerp2d(points[i - 1], points[i % len(points)], ratio2)
 
     def get_length(self, ratio: float) -> float:
         """Returns a path length relative to given ratio."""
@@ -271,6 +358,8 @@ class PathCircle(Path):
 
     __slots__ = ("position", "radius", "clockwise")
 
+    closed = True
+
     def __init__(self, position: Vector, rad: float, clockwise: bool=False):
         self.position = position
         self.radius = rad
@@ -300,18 +389,370 @@ class PathCircle(Path):
         return length / self.length
 
 
+class PathSpline(Path):
+
+    """Base class for curved paths, sampled by arc length.
+
+    When updated, each curve segment is divided in 'resolution' pieces whose
+    cumulative lengths are stored; positions are then found by binary search on
+    them, so objects move along the curve at constant speed. The speed varies
+    by about 2% with the default resolution, and a quarter as much with twice it."""
+
+    __slots__ = ("_points", "_closed", "resolution", "params", "offsets")
+
+    def __init__(self, points, closed: bool=False, resolution: int=128):
+        self._points = points
+        self._closed = closed
+        self.resolution = resolution
+        self.params = []
+        self.offsets = []
+        self.update()
+
+    @property
+    def points(self) -> list:
+        """Gets or sets the points of this path."""
+        return self._points
+
+    @points.setter
+    def points(self, value) -> None:
+        self._points = value
+        self.update()
+
+    @property
+    def closed(self) -> bool:
+        """Gets or sets whether this path loops back to its first point."""
+        return self._closed
+
+    @closed.setter
+    def closed(self, value) -> None:
+        self._closed = value
+        self.update()
+
+    @property
+    def segments(self) -> int:
+        """Gets the number of curve segments in this path."""
+        raise NotImplementedError("{} subclass method should be called.".format(self.__class__.__name__))
+
+    @property
+    def length(self) -> float:
+        """Gets the length of this path"""
+        return self.offsets[-1]
+
+    def evaluate(self, segment: int, t: float) -> tuple:
+        """Returns the point of a curve segment at parameter t (0 to 1)."""
+        raise NotImplementedError("{} subclass method should be called.".format(self.__class__.__name__))
+
+    def derivative(self, segment: int, t: float) -> tuple:
+        """Returns the derivative of a curve segment at parameter t (0 to 1)."""
+        raise NotImplementedError("{} subclass method should be called.".format(self.__class__.__name__))
+
+    def update(self) -> float:
+        """Calculates and stores the arc length table, returning the length of this path.
+
+        Must be called after the points list is changed in place."""
+        super(PathSpline, self).update()
+        params = self.params
+        offsets = self.offsets
+        del params[:], offsets[:]
+        params.append(0.0)
+        offsets.append(0.0)
+
+        segments = self.segments
+        if segments < 1:
+            return 0.0
+
+        length = 0.0
+        last = self.evaluate(0, 0.0)
+        for segment in range(segments):
+            for k in range(1, self.resolution + 1):
+                t = k / float(self.resolution)
+                point = self.evaluate(segment, t)
+                length += distance(last, point)
+                params.append(segment + t)
+                offsets.append(length)
+                last = point
+
+        return length
+
+    def get_param(self, ratio: float) -> float:
+        """Returns the curve parameter (segment index plus t) at the given ratio of the path's length."""
+        offsets = self.offsets
+        limit = offsets[-1] * ratio
+        i = min(bisect_right(offsets, limit), len(offsets) - 1)
+        span = offsets[i] - offsets[i - 1]
+        if span == 0.0:
+            return self.params[i]
+
+        return lerp1d(self.params[i - 1], self.params[i], (limit - offsets[i - 1]) / span)
+
+    def _split(self, ratio: float) -> tuple:
+        if ratio == 1.0:
+            return self.segments - 1, 1.0
+
+        param = self.get_param(ratio % 1.0)
+        segment = min(int(param), self.segments - 1)
+        return segment, param - segment
+
+    def get_position(self, ratio: float) -> tuple:
+        """Returns a position in the path relative to the ratio of its length."""
+        if self.offsets[-1] == 0:
+            return self._points[0] if self._points else (0.0, 0.0)
+
+        if ratio == 0.0 or (self._closed and ratio == 1.0):
+            return self.evaluate(0, 0.0)
+
+        return self.evaluate(*self._split(ratio))
+
+    def get_tangent(self, ratio: float) -> tuple:
+        """Returns the unit direction of the path at the given ratio of its length."""
+        if self.offsets[-1] == 0:
+            return 0.0, 0.0
+
+        if self._closed and ratio == 1.0:
+            ratio = 0.0
+
+        return normalize(self.derivative(*self._split(ratio)))
+
+    def get_angle(self, ratio: float) -> float:
+        """Returns the angle (in degrees) an object following the path faces at the given ratio."""
+        return angle(self.get_tangent(ratio))
+
+    def get_length(self, ratio: float) -> float:
+        """Returns a path length relative to given ratio."""
+        ratio %= 1.0
+        l = self.length
+
+        if l == 0.0 or ratio == 0.0:
+            return 0.0
+
+        return l * ratio
+
+    def get_ratio(self, length: float) -> float:
+        """Returns a value between 0 and 1 ralative to given length and this path's length."""
+        length %= self.length
+
+        return length / self.length
+
+
+class PathCatmullRom(PathSpline):
+
+    """A smooth path passing through all of its points."""
+
+    __slots__ = ()
+
+    @property
+    def segments(self) -> int:
+        """Gets the number of curve segments in this path."""
+        size = len(self._points)
+        if size < 2:
+            return 0
+        return size if self._closed else size - 1
+
+    def _controls(self, segment: int) -> tuple:
+        points = self._points
+        size = len(points)
+        if self._closed:
+            return (points[(segment - 1) % size], points[segment % size],
+                    points[(segment + 1) % size], points[(segment + 2) % size])
+
+        # the end points are repeated to make the curve reach them
+        return (points[max(segment - 1, 0)], points[segment],
+                points[segment + 1], points[min(segment + 2, size - 1)])
+
+    def evaluate(self, segment: int, t: float) -> tuple:
+        """Returns the point of a curve segment at parameter t (0 to 1)."""
+        p0, p1, p2, p3 = self._controls(segment)
+        t2 = t * t
+        t3 = t2 * t
+        return (
+            0.5 * ((2 * p1[0]) + (p2[0] - p0[0]) * t +
+                   (2 * p0[0] - 5 * p1[0] + 4 * p2[0] - p3[0]) * t2 +
+                   (3 * p1[0] - p0[0] - 3 * p2[0] + p3[0]) * t3),
+            0.5 * ((2 * p1[1]) + (p2[1] - p0[1]) * t +
+                   (2 * p0[1] - 5 * p1[1] + 4 * p2[1] - p3[1]) * t2 +
+                   (3 * p1[1] - p0[1] - 3 * p2[1] + p3[1]) * t3)
+        )
+
+    def derivative(self, segment: int, t: float) -> tuple:
+        """Returns the derivative of a curve segment at parameter t (0 to 1)."""
+        p0, p1, p2, p3 = self._controls(segment)
+        t2 = t * t
+        return (
+            0.5 * ((p2[0] - p0[0]) + 2 * (2 * p0[0] - 5 * p1[0] + 4 * p2[0] - p3[0]) * t +
+                   3 * (3 * p1[0] - p0[0] - 3 * p2[0] + p3[0]) * t2),
+            0.5 * ((p2[1] - p0[1]) + 2 * (2 * p0[1] - 5 * p1[1] + 4 * p2[1] - p3[1]) * t +
+                   3 * (3 * p1[1] - p0[1] - 3 * p2[1] + p3[1]) * t2)
+        )
+
+
+class PathBezier(PathSpline):
+
+    """A path of cubic bezier curves.
+
+    Points are given as [p0, c, c, p1, c, c, p2, ...], two control points between
+    each pair of path points. A closed path omits the last point, looping back to p0."""
+
+    __slots__ = ()
+
+    @property
+    def segments(self) -> int:
+        """Gets the number of curve segments in this path."""
+        size = len(self._points)
+        if self._closed:
+            return size // 3
+        return (size - 1) // 3 if size > 1 else 0
+
+    def update(self) -> float:
+        size = len(self._points)
+        if size > 1 and size % 3 != (0 if self._closed else 1):
+            raise ValueError("Bezier paths need 3 points per segment{}.".format("" if self._closed else ", plus one"))
+
+        return super(PathBezier, self).update()
+
+    def _controls(self, segment: int) -> tuple:
+        points = self._points
+        i = segment * 3
+        return points[i], points[i + 1], points[i + 2], points[(i + 3) % len(points)]
+
+    def evaluate(self, segment: int, t: float) -> tuple:
+        """Returns the point of a curve segment at parameter t (0 to 1)."""
+        p0, c0, c1, p1 = self._controls(segment)
+        u = 1.0 - t
+        a = u * u * u
+        b = 3 * u * u * t
+        c = 3 * u * t * t
+        d = t * t * t
+        return (
+            a * p0[0] + b * c0[0] + c * c1[0] + d * p1[0],
+            a * p0[1] + b * c0[1] + c * c1[1] + d * p1[1]
+        )
+
+    def derivative(self, segment: int, t: float) -> tuple:
+        """Returns the derivative of a curve segment at parameter t (0 to 1)."""
+        p0, c0, c1, p1 = self._controls(segment)
+        u = 1.0 - t
+        a = 3 * u * u
+        b = 6 * u * t
+        c = 3 * t * t
+        return (
+            a * (c0[0] - p0[0]) + b * (c1[0] - c0[0]) + c * (p1[0] - c1[0]),
+            a * (c0[1] - p0[1]) + b * (c1[1] - c0[1]) + c * (p1[1] - c1[1])
+        )
+
+
+class PathTable(object):
+
+    """The positions of a path baked for each step of an animation."""
+
+    __slots__ = ("path", "steps", "samples", "vectors", "valid")
+
+    def __init__(self, path: Path, steps: int):
+        self.path = path
+        self.steps = steps
+        self.valid = True
+
+        if steps > 1:
+            last = float(steps - 1)
+            samples = [path.get_position(step / last) for step in range(steps)]
+        else:
+            samples = [path.get_position(0.0)]
+
+        # vectors are stored as tuples so the shared samples can't be changed in place
+        self.vectors = isinstance(samples[0], Vector)
+        if self.vectors:
+            samples = [sample.xy for sample in samples]
+        self.samples = samples
+
+    def sample(self, step: int) -> float or tuple or Vector:
+        """Returns the path position at the given animation step."""
+        if self.vectors:
+            return Vector(*self.samples[step])
+        return self.samples[step]
+
+
+class PathBaker(object):
+
+    """Keeps the baked path tables shared by all PathStates animating the same path.
+
+    Tables are keyed by (path, steps); the least recently used are dropped
+    when there are more than 'capacity' of them."""
+
+    capacity = 256
+    tables = OrderedDict()
+
+    # scenes may be preloaded by other threads
+    lock = threading.RLock()
+
+    @classmethod
+    def bake(cls, path: Path, steps: int) -> PathTable:
+        """Returns the baked table of a path, baking it if needed."""
+        key = (path, steps)
+        with cls.lock:
+            table = cls.tables.get(key)
+            if table is None:
+                table = PathTable(path, steps)
+                cls.tables[key] = table
+                while len(cls.tables) > cls.capacity:
+                    cls.tables.popitem(last=False)[1].valid = False
+            else:
+                cls.tables.move_to_end(key)
+
+        return table
+
+    @classmethod
+    def discard(cls, path: Path) -> None:
+        """Drops every table baked from the given path."""
+        if not cls.tables:
+            return
+
+        with cls.lock:
+            for key in [key for key in cls.tables if key[0] is path]:
+                cls.tables.pop(key).valid = False
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drops all baked tables."""
+        with cls.lock:
+            for table in cls.tables.values():
+                table.valid = False
+            cls.tables.clear()
+
+
 class PathState(object):
 
-    __slots__ = ("attr", "asgnmode", "path", "counter", "_ratio", "_step", "_steps")
+    """The animation state of an attribute along a path.
+
+    By default the animation advances one of '_steps' steps per call to animate.
+    After set_timing it advances by the elapsed seconds given to animate instead,
+    optionally through an easing curve."""
+
+    __slots__ = ("attr", "asgnmode", "_path", "counter", "_ratio", "_step", "_steps", "_table", "_baked",
+                 "_time", "_duration", "easing", "_owner")
 
     def __init__(self, attr: str, asgnmode: AssignMode, path: Path) -> 'PathState':
         self.attr = attr
         self.asgnmode = asgnmode
-        self.path = path
+        self._path = path
         self.counter = -1
         self._ratio = 0.0
         self._step = 0
         self._steps = 60
+        self._table = None
+        self._baked = False
+        self._time = 0.0
+        self._duration = None
+        self.easing = None
+        self._owner = None
+
+    @property
+    def path(self) -> Path:
+        """Gets or sets the animated path."""
+        return self._path
+
+    @path.setter
+    def path(self, value) -> None:
+        self._path = value
+        self._table = None
 
     @property
     def ratio(self) -> float:
@@ -321,33 +762,150 @@ class PathState(object):
     @ratio.setter
     def ratio(self, value) -> None:
         self._ratio = value % 1.0
+        self._baked = False
 
     @property
     def length(self) -> float:
         """Gets or sets the ratio based on the path's length."""
-        return self.path.get_length(self._ratio)
+        return self._path.get_length(self._ratio)
 
     @length.setter
     def length(self, value) -> None:
-        self._ratio = self.path.get_ratio(value)
+        self._ratio = self._path.get_ratio(value)
+        self._baked = False
 
     @property
     def position(self) -> float or Vector:
         """Gets the position in the path."""
-        return self.path.get_position(self._ratio)
+        if self._baked:
+            # the ratio matches an animation step, so it is in the baked table
+            table = self._table
+            if table is None or not table.valid:
+                table = self._table = PathBaker.bake(self._path, self._steps)
+            return table.sample(self._step)
+
+        return self.get_position(self._ratio)
+
+    @property
+    def time(self) -> float:
+        """Gets the elapsed seconds of a timed animation."""
+        return self._time
+
+    @property
+    def is_timed(self) -> bool:
+        """Gets whether this path state is animated by elapsed time."""
+        return self._duration is not None
 
     @property
     def is_animating(self) -> bool:
         """Gets whether this path state animation hasn't stopped."""
+        if self._duration is not None:
+            return not (self._time >= self._duration and self.counter == 0)
         return not (self._step == self._steps - 1 and self.counter == 0)
 
+    def get_position(self, ratio: float) -> float or tuple or Vector:
+        """Returns the position in the path at the given (possibly eased) ratio.
+
+        Ratios past the ends of an open path, as given by elastic and back easing,
+        are extended along the line from its first to its last position, or
+        clamped to its ends if its positions aren't numbers or 2d points."""
+        if 0.0 <= ratio <= 1.0 or self._path.closed:
+            return self._path.get_position(ratio)
+
+        a = self._path.get_position(0.0)
+        b = self._path.get_position(1.0)
+        if isinstance(a, (int, float)):
+            return lerp1d(a, b, ratio)
+        if len(a) == 2:
+            pos = lerp2d(a, b, ratio)
+            return Vector(*pos) if isinstance(a, Vector) else pos
+        return a if ratio < 0.0 else b
+
+    def sample(self, time: float) -> float or tuple or Vector:
+        """Returns the position of a timed animation at the given elapsed time, without advancing it.
+
+        Useful to interpolate the rendering between two animation updates."""
+        duration = self._duration
+        if duration is None:
+            raise ValueError("sample() needs a timed path state (see set_timing).")
+        if self.counter < 0:
+            time %= duration
+        else:
+            time = max(0.0, min(time, duration))
+
+        ratio = time / duration
+        if self.easing is not None:
+            ratio = self.easing(ratio)
+
+        return self.get_position(ratio)
+
+    def get_data(self) -> dict:
+        """Returns the state of this animation: its path, attribute, assignment mode and progress.
+
+        Registered easing curves are kept by name."""
+        easing = self.easing
+        if easing is not None and Easing.curves.get(easing.function.__name__) is easing:
+            easing = easing.function.__name__
+        return {"attr": self.attr, "asgnmode": self.asgnmode.name, "path": self._path, "counter": self.counter,
+                "ratio": self._ratio, "step": self._step, "steps": self._steps, "baked": self._baked,
+                "time": self._time, "duration": self._duration, "easing": easing}
+
+    @classmethod
+    def from_data(cls, data: dict) -> 'PathState':
+        """Returns a new path state with the state returned by get_data."""
+        pathstate = cls(data["attr"], AssignMode[data["asgnmode"]], data["path"])
+        pathstate.counter = data["counter"]
+        pathstate._ratio = data["ratio"]
+        pathstate._step = data["step"]
+        pathstate._steps = data["steps"]
+        pathstate._baked = data["baked"]
+        pathstate._time = data["time"]
+        pathstate._duration = data["duration"]
+        easing = data["easing"]
+        pathstate.easing = Easing.get(easing) if isinstance(easing, str) else easing
+        return pathstate
+
     def set_animation(self, framerate: int=60, seconds: float=1.0, repeats: int=-1) -> None:
+        """Animates this path state in 'framerate * seconds' steps."""
         self.counter = repeats
         self._step = 0
         self._steps = int(framerate * seconds)
+        self._table = None
+        self._duration = None
+        self._restart()
+
+    def set_timing(self, seconds: float=1.0, repeats: int=-1, easing: Easing or str=None) -> None:
+        """Animates this path state by elapsed time, over the given seconds.
+
+        'easing' may be an Easing curve or the name of a registered one."""
+        if seconds <= 0.0:
+            raise ValueError("Animation duration must be greater than zero.")
+        if isinstance(easing, str):
+            easing = Easing.get(easing)
+
+        self.counter = repeats
+        self.easing = easing
+        self._time = 0.0
+        self._duration = float(seconds)
+        self._ratio = easing(0.0) if easing is not None else 0.0
+        self._baked = False
+        self._restart()
+
+    def _restart(self) -> None:
+        # an ended animation was dropped by its animator: it's registered again,
+        # if it's still the owner's path for the attribute
+        owner = self._owner
+        if owner is not None and owner.paths.get(self.attr) is self and owner.animator is not None:
+            owner.animator.add(owner, self)
 
-    def animate(self) -> bool:
-        """An animation helper method. Returns whether the animation has ended."""
+    def animate(self, seconds: float=None) -> bool:
+        """An animation helper method. Returns whether the animation has ended.
+
+        Timed animations advance by the given elapsed seconds, or by one
+        60th of a second if not given. Step animations ignore it."""
+
+        if self._duration is not None:
+            return self._advance(1 / 60.0 if seconds is None else seconds)
 
         finished = False
         if self.counter > 0:
@@ -361,10 +919,96 @@ class PathState(object):
             self._step = (self._step + 1) % (self._steps)
 
         self._ratio = self._step / float(self._steps - 1)
+        self._baked = True
+
+        return finished
+
+    def _advance(self, seconds: float) -> bool:
+        duration = self._duration
+        time = self._time + seconds
+
+        finished = False
+        while self.counter > 0 and time >= duration:
+            time -= duration
+            self.counter -= 1
+
+        if self.counter == 0:
+            if time >= duration:
+                time = duration
+                finished = True
+        elif self.counter < 0:
+            time %= duration
+
+        self._time = time
+        ratio = time / duration
+        self._ratio = self.easing(ratio) if self.easing is not None else ratio
 
         return finished
 
 
+class Animator(object):
+
+    """Steps the active path animations of the objects in a room.
+
+    Objects register their PathStates through set_path; each step only visits
+    the registered animations and drops the ones that ended."""
+
+    def __init__(self):
+        self.active = OrderedDict()
+
+    def add(self, owner: object, pathstate: PathState) -> None:
+        """Registers the animation of an object attribute, replacing the previous one."""
+        self.active[(owner, pathstate.attr)] = pathstate
+        pathstate._owner = owner
+
+    def remove(self, owner: object, attr: str) -> None:
+        """Unregisters the animation of an object attribute."""
+        self.active.pop((owner, attr), None)
+
+    def add_object(self, owner: object) -> None:
+        """Registers all the animations of an object."""
+        for pathstate in owner.paths.values():
+            self.add(owner, pathstate)
+
+    def remove_object(self, owner: object) -> None:
+        """Unregisters all the animations of an object."""
+        for attr in owner.paths:
+            self.remove(owner, attr)
+
+    def clear(self) -> None:
+        self.active.clear()
+
+    def step(self, game: type, room: object, seconds: float=None) -> None:
+        """Advances all the active animations by one step, or by the elapsed seconds if timed."""
+        ended = []
+        direct = AssignMode.direct_value
+        vector = AssignMode.vector_updt
+
+        for key, pathstate in self.active.items():
+            if not pathstate.is_animating:
+                ended.append((key, pathstate, False))
+                continue
+
+            finished = pathstate.animate(seconds)
+            if pathstate.asgnmode is direct:
+                setattr(key[0], key[1], pathstate.position)
+            elif pathstate.asgnmode is vector:
+                getattr(key[0], key[1]).xy = pathstate.position
+
+            if finished:
+                ended.append((key, pathstate, True))
+
+        # all the ended animations are dropped before any callback, as the callbacks
+        # may remove other paths or set new ones (which must not be dropped)
+        for key, pathstate, finished in ended:
+            if self.active.get(key) is pathstate:
+                del self.active[key]
+
+        for key, pathstate, finished in ended:
+            if finished:
+                key[0].on_animation_end(key[1], pathstate, game, room)
+
+
 class Parallax(object):
 
     def __init__(self, image: pygame.Surface, scrollratio: Vector):
@@ -384,53 +1028,154 @@ class Parallax(object):
 
 class BackScroller(object):
 
+    """A tiled background layer scrolling with the view.
+
+    The tile image is repeated once, at startup, into a strip one tile larger than
+    the view in each direction and converted to the display format, so each frame
+    takes a single blit."""
+
     def __init__(self, bgi: pygame.Surface, surface_size: tuple, view_position=(0, 0)):
+        self.source = bgi
         self.back = bgi
-        self.view_w, self.view_h = surface_size
+        self.zoom = 1.0
         self.view_x, self.view_y = view_position
         self.image_w, self.image_h = bgi.get_size()
 
         self.origin_x = 0
         self.origin_y = 0
-        self.widths = []
-        self.heights = []
+        self.strip = None
 
+        self.resize(surface_size)
         self.update(Vector.zero())
 
+    def resize(self, surface_size: tuple, zoom: float=1.0) -> None:
+        """Builds the tiled strip for the given view size, with the tile scaled by zoom."""
+        if zoom != self.zoom:
+            self.zoom = zoom
+            if zoom == 1.0:
+                self.back = self.source
+            else:
+                w, h = self.source.get_size()
+                size = (max(1, int(round(w * zoom))), max(1, int(round(h * zoom))))
+                self.back = pygame.transform.scale(self.source, size)
+            self.image_w, self.image_h = self.back.get_size()
+
+        self.view_w, self.view_h = surface_size
+        cols = -(-self.view_w // self.image_w) + 1
+        rows = -(-self.view_h // self.image_h) + 1
+
+        strip = pygame.Surface((cols * self.image_w, rows * self.image_h), 0, self.back)
+        if self.back.get_bitsize() == 8:
+            strip.set_palette(self.back.get_palette())
+        strip.blits([
+            (self.back, (col * self.image_w, row * self.image_h)) for row in range(rows) for col in range(cols)
+        ], False)
+
+        if pygame.display.get_surface() is not None:
+            strip = strip.convert()
+        self.strip = strip
+
     def update(self, scroll_motion:Vector=None) -> None:
-        """
-        """
+        """Scrolls this layer by the given motion."""
 
         if scroll_motion is None:
             return
 
-        del self.widths[:], self.heights[:]
-
         self.view_x += scroll_motion[0]
         self.view_y += scroll_motion[1]
 
-        self.origin_x = self.view_x % self.image_w
-        self.origin_y = self.view_y % self.image_h
+        self.origin_x = int(self.view_x * self.zoom % self.image_w)
+        self.origin_y = int(self.view_y * self.zoom % self.image_h)
 
-        x = -self.origin_x
-        while x < self.view_w:
-            w = min(self.image_w, self.view_w - x)
-            self.widths.append((x, w))
-            x += self.image_w
+    def render(self, surface: pygame.Surface, blendmode: int=0) -> int:
+        """Draws this layer and returns the number of blits it took."""
+        surface.blit(self.strip, (0, 0), (self.origin_x, self.origin_y, self.view_w, self.view_h), blendmode)
+        return 1
+
+
+class ParallaxLayers(object):
+
+    """A stack of BackScroller layers, each scrolling slower than the one before.
+
+    When no layer has scrolled since the previous frame, the layers are composited
+    once into a cached background, which is then drawn with a single blit. That
+    only gives the same result for the blend modes in 'composites' (the order of
+    the blits doesn't matter for them); with other modes the layers are always
+    drawn one by one."""
+
+    # the blend modes the layers can be composited with first, and the color they start from
+    composites = {
+        0: (0, 0, 0),
+        pygame.BLEND_ADD: (0, 0, 0),
+        pygame.BLEND_MAX: (0, 0, 0),
+        pygame.BLEND_MIN: (255, 255, 255),
+    }
+
+    def __init__(self, layers: list, blendmode: int=0, falloff: float=0.75):
+        self.layers = layers
+        self.blendmode = blendmode
+        self.falloff = falloff
+        self.background = None
+        self.blits = 0
+        self._offsets = None
+        self._stale = True
 
-        y = -self.origin_y
-        while y < self.view_h:
-            h = min(self.image_h, self.view_h - y)
-            self.heights.append((y, h))
-            y += self.image_h
+    @property
+    def size(self) -> tuple:
+        """Gets the size of the area drawn by the layers."""
+        return self.layers[0].view_w, self.layers[0].view_h
 
-    def render(self, surface: pygame.Surface, blendmode: int=0) -> int:
-        i = 0
-        for y, h in self.heights:
-            for x, w in self.widths:
-                surface.blit(self.back, (x, y), [0, 0, w, h], blendmode)
-                i+=1
-        return i
+    @property
+    def zoom(self) -> float:
+        return self.layers[0].zoom
+
+    def resize(self, surface_size: tuple, zoom: float=1.0) -> None:
+        for layer in self.layers:
+            layer.resize(surface_size, zoom)
+            layer.update(Vector.zero())
+        self.background = None
+        self._offsets = None
+
+    def update(self, motion: Vector) -> None:
+        """Scrolls the layers by the view motion."""
+        motion = motion * 1.0
+        for layer in self.layers:
+            motion *= self.falloff
+            layer.update(motion)
+
+    def render(self, surface: pygame.Surface) -> int:
+        """Draws the layers and returns the number of blits it took."""
+        offsets = [(layer.origin_x, layer.origin_y) for layer in self.layers]
+        count = 0
+
+        if offsets != self._offsets or self.blendmode not in self.composites:
+            # still scrolling: draw the layers straight onto the surface
+            self._offsets = offsets
+            self._stale = True
+            for layer in self.layers:
+                count += layer.render(surface, self.blendmode)
+        else:
+            if self._stale:
+                self._composite()
+                count += len(self.layers)
+            surface.blit(self.background, (0, 0), None, self.blendmode)
+            count += 1
+
+        self.blits = count
+        return count
+
+    def _composite(self) -> None:
+        size = self.size
+        if self.background is None or self.background.get_size() != size:
+            self.background = pygame.Surface(size)
+            if pygame.display.get_surface() is not None:
+                self.background = self.background.convert()
+
+        # the layers blend together first, then the result onto the surface, in the same mode
+        self.background.fill(self.composites[self.blendmode])
+        for layer in self.layers:
+            layer.render(self.background, self.blendmode)
+        self._stale = False
 
 
 class Shape(object):
@@ -617,6 +1362,9 @@ class Shape(object):
     def update(self, view: 'View') -> None:
         pass
 
+    def get_bounds(self) -> tuple:
+        raise NotImplementedError("{} is an abstract base class.".format(self.__class__.__qualname__))
+
     def rotate(self, angle: float) -> 'self':
         raise NotImplementedError("{} is an abstract base class.".format(self.__class__.__qualname__))
 
@@ -627,8 +1375,77 @@ class Shape(object):
         raise NotImplementedError("{} is an abstract base class.".format(self.__class__.__qualname__))
 
 
+class SpriteCache(object):
+
+    """Keeps polygon outlines pre-rendered at 'rotations' quantized angles.
+
+    Sprites are shared by every polygon with the same refpoints, scale and colors,
+    rendered the first time they're needed and dropped, least recently used first,
+    when there are more than 'capacity' of them."""
+
+    rotations = 64
+    capacity = 1024
+    sprites = OrderedDict()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, polygon: 'Polygon', zoom: float=1.0) -> tuple:
+        """Returns the sprite of a polygon at its current rotation and the offset to draw it from its position."""
+        step = int(round(polygon.rotation * cls.rotations / 360.0)) % cls.rotations
+        scale = polygon.scale if zoom == 1.0 else polygon.scale * zoom
+
+        # the refpoints are stored with the sprite, so their id can't be reused while it is cached
+        key = (id(polygon.refpoints), scale.xy, polygon.fillcolor, polygon.linecolor, step)
+        entry = cls.sprites.get(key)
+        if entry is None:
+            cls.misses += 1
+            entry = cls.render(polygon.refpoints, scale, polygon.fillcolor, polygon.linecolor,
+                               step * 360.0 / cls.rotations)
+            cls.sprites[key] = entry
+            while len(cls.sprites) > cls.capacity:
+                cls.sprites.popitem(last=False)
+        else:
+            cls.hits += 1
+            cls.sprites.move_to_end(key)
+
+        return entry[1], entry[2]
+
+    @staticmethod
+    def render(refpoints: list, scale: Vector, fillcolor: tuple, linecolor: tuple, rotation: float) -> tuple:
+        """Renders a polygon outline at the given rotation, as Polygon.update transforms it.
+
+        Returns the refpoints, the sprite surface and the offset of its top left corner."""
+        rad = math.radians(rotation)
+        cos = math.cos(rad)
+        sin = math.sin(rad)
+        points = [Vector.zero().rescaled(point, scale).fast_rotate(cos, sin).xy for point in refpoints]
+
+        left = int(math.floor(min(x for x, y in points))) - 1
+        top = int(math.floor(min(y for x, y in points))) - 1
+        w = int(math.ceil(max(x for x, y in points))) - left + 2
+        h = int(math.ceil(max(y for x, y in points))) - top + 2
+
+        local = [(x - left, y - top) for x, y in points]
+        sprite = pygame.Surface((w, h), pygame.SRCALPHA)
+        pygame.draw.polygon(sprite, fillcolor, local)
+        pygame.draw.aalines(sprite, linecolor, True, local)
+        if pygame.display.get_surface() is not None:
+            sprite = sprite.convert_alpha()
+
+        return refpoints, sprite, (left, top)
+
+    @classmethod
+    def clear(cls) -> None:
+        cls.sprites.clear()
+
+
 class Polygon(Shape):
 
+    # when set, default_render blits a cached sprite at a quantized rotation instead of
+    # drawing the outline (see SpriteCache)
+    cached_render = False
+
     def __init__(self, position: Vector, rotation: float, scale: Vector, refpoints: list):
         super(Polygon, self).__init__()
         self.position = position
@@ -644,19 +1461,26 @@ class Polygon(Shape):
         rad = math.radians(self.rotation)
         cos = math.cos(rad)
         sin = math.sin(rad)
+        zoom = view.zoom
         for i in range(len(self.refpoints)):
             self.points[i].rescaled(self.refpoints[i], self.scale).fast_rotate(cos, sin).translated(self.position)
             #self.points[i].fast_rotate(cos, sin)
             #self.draw_points[i] = self.points[i].ixy
             self.draw_points[i] = (
-                self.points[i].x - view.position.x,
-                self.points[i].y - view.position.y
+                (self.points[i].x - view.position.x) * zoom,
+                (self.points[i].y - view.position.y) * zoom
             )
 
     @property
     def shape(self) -> type:
         return Polygon
 
+    def get_bounds(self) -> tuple:
+        """Returns the (left, top, right, bottom) box of the transformed points."""
+        xs = [point.x for point in self.points]
+        ys = [point.y for point in self.points]
+        return min(xs), min(ys), max(xs), max(ys)
+
     def rotate(self, angle: float) -> 'self':
         self.rotation = (self.rotation + angle) % 360.0
         return self
@@ -684,8 +1508,18 @@ class Polygon(Shape):
         #return result.get(other.shape, SAT_NO_COLLISION)
 
     def default_render(self, surface: pygame.Surface, view: 'View') -> None:
-        pygame.draw.polygon(surface, self.fillcolor, self.draw_points)
-        pygame.draw.aalines(surface, self.linecolor, True, self.draw_points)
+        if self.cached_render:
+            zoom = view.zoom
+            sprite, offset = SpriteCache.get(self, zoom)
+            x = int((self.position.x - view.position.x) * zoom) + offset[0]
+            y = int((self.position.y - view.position.y) * zoom) + offset[1]
+            Display.mark(surface, surface.blit(sprite, (x, y)))
+            return
+
+        rect = draw(surface, pygame.draw.polygon, self.fillcolor, self.draw_points)
+        outline = draw(surface, pygame.draw.aalines, self.linecolor, True, self.draw_points)
+        if rect is not None:
+            Display.mark(surface, rect.union(outline))
 
 
 class Circle(Shape):
@@ -699,6 +1533,12 @@ class Circle(Shape):
     def shape(self) -> type:
         return Circle
 
+    def get_bounds(self) -> tuple:
+        """Returns the (left, top, right, bottom) box of this circle."""
+        x, y = self.position
+        r = self.radius
+        return x - r, y - r, x + r, y + r
+
     def rotate(self, angle: float) -> 'self':
         return self
 
@@ -718,7 +1558,8 @@ class Circle(Shape):
         return result.get(other.__class__, SAT_NO_COLLISION)
 
     def default_render(self, surface: pygame.Surface, view: 'View'):
-        pos = self.position - view.position
-        rad = int(self.radius)
-        pygame.gfxdraw.filled_circle(surface, pos.ix, pos.iy, rad, self.fillcolor)
-        pygame.gfxdraw.aacircle(surface, pos.ix, pos.iy, rad, self.linecolor)
\ No newline at end of file
+        pos = (self.position - view.position) * view.zoom
+        rad = int(self.radius * view.zoom)
+        draw(surface, pygame.gfxdraw.filled_circle, pos.ix, pos.iy, rad, self.fillcolor)
+        draw(surface, pygame.gfxdraw.aacircle, pos.ix, pos.iy, rad, self.linecolor)
+        Display.mark(surface, (pos.ix - rad, pos.iy - rad, rad * 2 + 1, rad * 2 + 1))
\ No newline at end of file
@@ -0,0 +1,355 @@
+__author__ = 'Jorge'
+
+# Headless benchmark of the game scenes.
+#
+# Runs each scene for a fixed number of frames on the SDL dummy video driver,
+# with synthetic input and without frame rate limit, and reports the simulation
+# and render time per frame:
+#
+#     python -m spacegame.benchmark [--frames N] [--warmup N] [--actors N] [scene ...]
+
+
+import os
+import sys
+import math
+import random
+import argparse
+import statistics
+import pygame
+import pygame.locals as c
+from spacegame.core import Game
+from spacegame.core import Display
+from spacegame.profiler import Profiler
+from spacegame.streaming import ChunkStore
+from spacegame.streaming import ChunkStreamer
+from spacegame.assets import AssignMode
+from spacegame.assets import PathCircle
+from spacegame.actors import Actor
+from spacegame.actors import Room
+from spacegame.vectors import Vector
+from spacegame.scenes import SceneMain
+from spacegame.scenes import SceneOption
+from spacegame.scenes import SceneGame
+
+
+__all__ = [
+    "SceneGameStress",
+    "SceneGameCached",
+    "SceneGamePaths",
+    "SceneGameParticles",
+    "SceneGameStreaming",
+    "InputScript",
+    "Benchmark",
+    "SCENES"
+]
+
+
+class SceneGameStress(SceneGame):
+
+    """The game scene with many drifting actors."""
+
+    count = 50
+
+    class Drone(Actor):
+
+        refpoints = [(0.5, 0.0), (-0.5, 0.4), (-0.3, 0.0), (-0.5, -0.4)]
+
+        def __init__(self, position: Vector, rotation: float, motion: Vector):
+            super(SceneGameStress.Drone, self).__init__(SceneGameStress.Drone.refpoints)
+            self.position.xy = position
+            self.rotation = rotation
+            self.scale.xy = (20, 20)
+            self.motion = motion
+            self.fillcolor = (0, 128, 0)
+            self.linecolor = (64, 255, 64)
+
+        def on_keydown(self, keys: tuple, game: type, room: Room) -> None:
+            self.rotation = (self.rotation + 1) % 360
+
+    @classmethod
+    def create_drone(cls, rnd: random.Random) -> Actor:
+        angle = rnd.uniform(0.0, 2 * math.pi)
+        speed = rnd.uniform(0.0, 2.0)
+        return cls.Drone(
+            Vector(rnd.uniform(-800, 1600), rnd.uniform(-600, 1200)),
+            rnd.uniform(0, 360),
+            Vector(math.cos(angle) * speed, math.sin(angle) * speed)
+        )
+
+    @classmethod
+    def create_room(cls) -> Room:
+        rnd = random.Random(cls.__name__)
+        room = super(SceneGameStress, cls).create_room()
+        room.add_actors([cls.create_drone(rnd) for _ in range(cls.count)])
+        return room
+
+
+class SceneGameCached(SceneGameStress):
+
+    """The stress scene, with the actors drawn from the sprite cache."""
+
+    @classmethod
+    def create_drone(cls, rnd: random.Random) -> Actor:
+        drone = super(SceneGameCached, cls).create_drone(rnd)
+        drone.cached_render = True
+        return drone
+
+
+class SceneGamePaths(SceneGameStress):
+
+    """The stress scene, with the actors moved along circular paths."""
+
+    @classmethod
+    def create_drone(cls, rnd: random.Random) -> Actor:
+        drone = super(SceneGamePaths, cls).create_drone(rnd)
+        drone.motion = Vector.zero()
+        path = PathCircle(Vector(*drone.position), rnd.uniform(20, 200), rnd.random() < 0.5)
+        drone.set_path('position', path, AssignMode.vector_updt, -1, rnd.random())
+        return drone
+
+
+class SceneGameParticles(SceneGame):
+
+    """The game scene with fountains keeping about 'count' particles alive."""
+
+    count = 50000
+
+    class Fountain(Actor):
+
+        refpoints = [(0.5, 0.0), (0.0, 0.5), (-0.5, 0.0), (0.0, -0.5)]
+
+        def __init__(self, position: Vector, rate: int):
+            super(SceneGameParticles.Fountain, self).__init__(SceneGameParticles.Fountain.refpoints)
+            self.position.xy = position
+            self.scale.xy = (10, 10)
+            self.rate = rate
+            self.fillcolor = (128, 0, 128)
+            self.linecolor = (255, 64, 255)
+
+        def on_keydown(self, keys: tuple, game: type, room: Room) -> None:
+            self.rotation = (self.rotation + 3) % 360
+            room.particles.emit(self.rate, self.position.xy, (0, 0), self.rotation, 30, (20, 200),
+                                (1.0, 2.0), (255, 224, 96))
+
+    @classmethod
+    def create_room(cls) -> Room:
+        room = super(SceneGameParticles, cls).create_room()
+        # particles live 1.5 seconds on average, at 60 frames per second
+        rate = int(cls.count / (1.5 * 60) / 4)
+        room.add_actors([cls.Fountain(Vector(x, y), rate) for x, y in ((150, 150), (650, 150), (150, 450), (650, 450))])
+        return room
+
+
+class SceneGameStreaming(SceneGameStress):
+
+    """The stress scene in a world 'extent' units wide, with its actors streamed
+    in chunks around the view (about one per chunk)."""
+
+    count = 1600
+    extent = 40960
+    streamer = None
+
+    @classmethod
+    def create_room(cls) -> Room:
+        rnd = random.Random(cls.__name__)
+        room = super(SceneGameStress, cls).create_room()
+        cls.streamer = ChunkStreamer(room, ChunkStore())
+
+        half = cls.extent / 2.0
+        drones = []
+        for _ in range(cls.count):
+            drone = cls.create_drone(rnd)
+            drone.position.xy = (rnd.uniform(-half, half), rnd.uniform(-half, half))
+            drones.append(drone)
+        cls.streamer.add_actors(drones)
+        return room
+
+
+class InputScript(object):
+
+    """Synthetic input for a benchmark run.
+
+    Every frame, the events returned by 'events' are posted to the event queue
+    and the keys returned by 'keys' are reported as held down by
+    pygame.key.get_pressed (replaced while the script is installed)."""
+
+    def __init__(self, events=None, keys=None):
+        self.events = events
+        self.keys = keys
+        self.pressed = ()
+        self._get_pressed = None
+
+    def install(self) -> None:
+        self._get_pressed = pygame.key.get_pressed
+        pygame.key.get_pressed = self.get_pressed
+
+    def uninstall(self) -> None:
+        if self._get_pressed is not None:
+            pygame.key.get_pressed = self._get_pressed
+            self._get_pressed = None
+
+    def get_pressed(self) -> tuple:
+        return self.pressed
+
+    def step(self, frame: int) -> None:
+        """Sets the input for the given frame."""
+        held = set(self.keys(frame)) if self.keys is not None else ()
+        pressed = [0] * len(self._get_pressed())
+        for key in held:
+            if 0 <= key < len(pressed):
+                pressed[key] = 1
+        self.pressed = tuple(pressed)
+
+        if self.events is not None:
+            for event in self.events(frame):
+                pygame.event.post(event)
+
+    @staticmethod
+    def hover(buttons: list, period: int=20):
+        """Returns an event script moving the mouse in and out of the given (x, y) points."""
+        def events(frame: int) -> list:
+            if frame % period:
+                return []
+            n = frame // period
+            x, y = buttons[(n // 2) % len(buttons)] if n % 2 == 0 else (700, 500)
+            return [pygame.event.Event(c.MOUSEMOTION, pos=(x, y), rel=(0, 0), buttons=(0, 0, 0))]
+        return events
+
+    @staticmethod
+    def flight(frame: int) -> tuple:
+        """A key script thrusting and turning the starship."""
+        keys = [c.K_w] if frame % 120 < 60 else []
+        keys.append(c.K_a if frame % 240 < 120 else c.K_d)
+        return keys
+
+
+# the scenes to benchmark, by name: (scene, input)
+SCENES = {
+    "main": (SceneMain, lambda: InputScript(InputScript.hover([(150, 120), (150, 170)]))),
+    "option": (SceneOption, lambda: InputScript(InputScript.hover([(150, 120)]))),
+    "game": (SceneGame, lambda: InputScript(InputScript.hover([(150, 560)]), InputScript.flight)),
+    "stress": (SceneGameStress, lambda: InputScript(None, InputScript.flight)),
+    "cached": (SceneGameCached, lambda: InputScript(None, InputScript.flight)),
+    "paths": (SceneGamePaths, lambda: InputScript(None, InputScript.flight)),
+    "particles": (SceneGameParticles, lambda: InputScript(None, InputScript.flight)),
+    "streaming": (SceneGameStreaming, lambda: InputScript(None, InputScript.flight)),
+}
+
+
+class Benchmark(object):
+
+    """Plays scenes for a fixed number of frames and collects their frame times."""
+
+    def __init__(self, frames: int=300, warmup: int=30):
+        self.frames = frames
+        self.warmup = warmup
+        self.sim = []
+        self.render = []
+        self._frame = 0
+        self._script = None
+
+    @staticmethod
+    def setup(size: tuple=(800, 600)) -> None:
+        """Opens a display on the dummy video driver."""
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+        pygame.init()
+        Display.show(size)
+        Display.set_limit_fps(False)
+
+    def run(self, scene: type, script: InputScript) -> dict:
+        """Plays the scene and returns its timing statistics, in milliseconds."""
+        self.sim = []
+        self.render = []
+        self._frame = 0
+        self._script = script
+
+        pygame.event.clear()
+        script.install()
+        on_frame, Display.on_frame = Display.on_frame, self._on_frame
+        try:
+            script.step(0)
+            Game.scene = scene
+            scene.play(Game)
+        finally:
+            Display.on_frame = on_frame
+            script.uninstall()
+            Game.scene = None
+
+        return {
+            "sim": self.summary(self.sim),
+            "render": self.summary(self.render),
+            "frame": self.summary([a + b for a, b in zip(self.sim, self.render)]),
+        }
+
+    def _on_frame(self) -> None:
+        self._frame += 1
+        if self._frame > self.warmup:
+            self.sim.append(Display.sim_time * 1000.0)
+            self.render.append(Display.render_time * 1000.0)
+
+        if self._frame >= self.warmup + self.frames:
+            Game.end()
+        else:
+            self._script.step(self._frame)
+
+    @staticmethod
+    def summary(times: list) -> dict:
+        """Returns the mean, median, 95th percentile and standard deviation of the times."""
+        if not times:
+            return {"mean": 0.0, "median": 0.0, "p95": 0.0, "stdev": 0.0}
+
+        ordered = sorted(times)
+        return {
+            "mean": statistics.mean(ordered),
+            "median": statistics.median(ordered),
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "stdev": statistics.pstdev(ordered),
+        }
+
+
+def main(argv: list=None) -> int:
+    parser = argparse.ArgumentParser(prog="spacegame.benchmark", description="Headless benchmark of the game scenes.")
+    parser.add_argument("scenes", nargs="*", metavar="scene",
+                        help="scenes to run: {}".format(", ".join(SCENES)))
+    parser.add_argument("--frames", type=int, default=300, help="measured frames per scene")
+    parser.add_argument("--warmup", type=int, default=30, help="frames run before measuring")
+    parser.add_argument("--actors", type=int, help="actors in the stress scenes ({} by default, {} when streamed)".format(
+                        SceneGameStress.count, SceneGameStreaming.count))
+    parser.add_argument("--pipelined", action="store_true", help="composite on a worker thread")
+    parser.add_argument("--csv", metavar="FILE", help="stream the time of each frame phase to a CSV file")
+    args = parser.parse_args(argv)
+    for name in args.scenes:
+        if name not in SCENES:
+            parser.error("unknown scene '{}'".format(name))
+
+    Benchmark.setup()
+    if args.actors is not None:
+        SceneGameStress.count = SceneGameStreaming.count = args.actors
+    Display.set_pipelined(args.pipelined)
+    benchmark = Benchmark(args.frames, args.warmup)
+    if args.csv:
+        Profiler.open_csv(args.csv)
+
+    row = "{:<8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}"
+    print(row.format("scene", "sim", "render", "frame", "median", "p95", "stdev"))
+    for name in args.scenes or SCENES:
+        scene, script = SCENES[name]
+        stats = benchmark.run(scene, script())
+        frame = stats["frame"]
+        print(row.format(name, *("{:.3f}".format(value) for value in (
+            stats["sim"]["mean"], stats["render"]["mean"], frame["mean"],
+            frame["median"], frame["p95"], frame["stdev"]))))
+
+        streamer = getattr(scene, "streamer", None)
+        if streamer is not None:
+            print("{:<8} {} chunks loaded, {} unloaded, {} prefetched, {} stalls, {} actors moved".format(
+                "", streamer.loads, streamer.unloads, streamer.prefetches, streamer.stalls, streamer.moves))
+
+    Profiler.close_csv()
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
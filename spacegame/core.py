@@ -1,7 +1,11 @@
 __author__ = "Jorge A. Gomes"
 
 from os import path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import time
 import pygame
+from spacegame.pacing import FramePacer
 
 __all__ = [
     "Game",
@@ -11,22 +15,32 @@ __all__ = [
 ]
 
 
+@lru_cache(maxsize=None)
 def resource(name) -> str:
-    """Returns the full path of a file with given name."""
-    cwd = path.split(__file__)[0]
-    rd = 'res\\{}'.format(name)
-    return path.join(cwd, rd)
+    """Returns the full path of a file with given name, in the resources folder."""
+    return path.join(path.dirname(path.abspath(__file__)), 'res', name)
 
 
 class Game(object):
 
-    """The game launcher."""
+    """The game launcher.
+
+    While the game runs, scenes are preloaded by a thread pool: goto() starts
+    preloading the next scene, which is played once that's done. A scene can
+    also be preloaded ahead, while the current one is still playing; that's
+    cancelled, or its result dropped, if the game goes to another scene.
+    Only scenes overriding Scene.preload are preloaded."""
 
     scene = None
+    pool = None
+    workers = 2
+    _preloads = {}
 
     @classmethod
     def goto(cls, scene) -> None:
         """Sets the next scene to play"""
+        cls.drop_preloads(scene)
+        cls.preload(scene)
         cls.scene = scene
 
     @classmethod
@@ -34,27 +48,133 @@ class Game(object):
         """Ends the game (by setting None as next scene)."""
         cls.scene = None
 
+    @classmethod
+    def preload(cls, scene) -> None:
+        """Starts preloading a scene in the background, if it isn't already."""
+        if scene is None or cls.pool is None or scene in cls._preloads:
+            return
+        if getattr(scene.preload, '__func__', None) is Scene.preload.__func__:
+            # nothing to prepare
+            return
+        cls._preloads[scene] = cls.pool.submit(scene.preload)
+
+    @classmethod
+    def drop_preloads(cls, keep=None) -> None:
+        """Cancels the preloading of every scene but 'keep', or drops what it returned."""
+        for scene in list(cls._preloads):
+            if scene is not keep:
+                cls._preloads.pop(scene).cancel()
+
+    @classmethod
+    def preloaded(cls, scene) -> object:
+        """Returns what the preloading of a scene returned, only once, or None if it wasn't preloaded.
+
+        Waits for it if it's still running; errors raised by the preloading are raised here."""
+        future = cls._preloads.pop(scene, None)
+        if future is None:
+            return None
+        return future.result()
+
+    @classmethod
+    def wait_preload(cls, scene) -> None:
+        """Shows the progress of the preloading of a scene until it's done."""
+        future = cls._preloads.get(scene)
+        if future is None or future.done():
+            return
+
+        # the whole screen is drawn every frame (the scene sets its own mode when played)
+        Display.set_dirty_mode(False)
+        surface = Display.surface()
+        w, h = surface.get_size()
+        bar = pygame.Rect(w // 4, h // 2 - 8, w // 2, 16)
+        tick = 0
+        while not future.done() and cls.scene is scene:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    cls.end()
+
+            progress = scene.progress()
+            surface.fill((0, 0, 0))
+            pygame.draw.rect(surface, (96, 96, 96), bar, 1)
+            if progress is None:
+                # unknown: a block sliding back and forth
+                x = abs((tick * 8) % (2 * (bar.w - 32)) - (bar.w - 32))
+                surface.fill((192, 192, 192), (bar.x + x, bar.y + 2, 32, bar.h - 4))
+            else:
+                surface.fill((192, 192, 192), (bar.x + 2, bar.y + 2, int((bar.w - 4) * progress), bar.h - 4))
+            tick += 1
+            Display.on_screen(30)
+
     @classmethod
     def run(cls, scene) -> None:
         """Starts the game by running the first scene."""
 
         Display.show((800, 600))
+        cls.pool = ThreadPoolExecutor(cls.workers)
 
-        cls.scene = scene
+        cls.goto(scene)
 
         # while there's a scene set
         while cls.scene is not None:
-            # plays this scene
-            cls.scene.play(cls)
+            scene = cls.scene
+            cls.wait_preload(scene)
+            # plays this scene, unless the game ended while preloading
+            if cls.scene is scene:
+                scene.play(cls)
+
+        cls.drop_preloads()
+        cls.pool.shutdown(wait=False)
+        cls.pool = None
+        cls._preloads.clear()
 
 
 class Display(object):
 
-    clock = pygame.time.Clock()
+    # the frames are paced, and their budget kept, by the FramePacer
+    clock = FramePacer.clock
+
+    # dirty rectangles rendering: only the areas drawn in the current and previous
+    # frames are restored and sent to the screen, unless they cover more than
+    # 'dirty_limit' of it.
+    dirty_mode = False
+    dirty_limit = 0.5
+    _dirty = []
+    _previous = []
+    _full = True
+
+    # pipelined rendering: scenes drawing through a RenderQueue composite their
+    # frames on a worker thread while the next frame is simulated.
+    pipelined = False
+
+    # frame timing: the time spent simulating (before begin_render) and rendering
+    # the last frame, without the time waited to keep the frame rate; 'on_frame'
+    # is called at the end of every frame, if set.
+    limit_fps = True
+    sim_time = 0.0
+    render_time = 0.0
+    idle_time = 0.0
+    on_frame = None
+    _frame_start = 0.0
+    _render_start = None
+
+    # internal render resolution: the game world is drawn into a target 'scale'
+    # times the window size, then stretched to the window with or without
+    # filtering. In auto mode the scale drops while the frames take longer than
+    # 'budget' seconds and rises again when there's headroom.
+    scale = 1.0
+    smooth = False
+    auto_scale = False
+    budget = 1.0 / 60.0
+    min_scale = 0.5
+    scale_step = 0.125
+    _target = None
+    _load = 0.0
+    _cooldown = 0
 
     @classmethod
     def show(cls, size, flags=0) -> None:
         pygame.display.set_mode(size, flags)
+        cls._full = True
 
     @classmethod
     def surface(cls) -> pygame.Surface:
@@ -64,15 +184,162 @@ class Display(object):
     def size(cls) -> tuple:
         return cls.surface().get_size()
 
+    @classmethod
+    def set_dirty_mode(cls, enabled: bool) -> None:
+        """Enables or disables the dirty rectangles rendering."""
+        cls.dirty_mode = enabled
+        cls._full = True
+        cls._dirty = []
+        cls._previous = []
+
+    @classmethod
+    def set_limit_fps(cls, enabled: bool) -> None:
+        """Enables or disables the frame rate limit given to on_screen."""
+        cls.limit_fps = enabled
+
+    @classmethod
+    def begin_render(cls) -> None:
+        """Tells that the simulation of the current frame is done and its rendering starts."""
+        cls._render_start = time.perf_counter()
+
+    @classmethod
+    def set_scale(cls, scale: float, smooth: bool=None) -> None:
+        """Sets the internal render resolution, as a fraction of the window size."""
+        cls.scale = min(1.0, max(cls.min_scale, float(scale)))
+        if smooth is not None:
+            cls.smooth = smooth
+
+    @classmethod
+    def set_auto_scale(cls, enabled: bool, budget: float=None) -> None:
+        """Enables or disables the automatic render resolution, for a frame time budget in seconds."""
+        cls.auto_scale = enabled
+        if budget is not None:
+            cls.budget = budget
+        cls._load = 0.0
+        cls._cooldown = 0
+
+    @classmethod
+    def target(cls) -> pygame.Surface:
+        """Returns the surface the game world is drawn into: the display surface, unless scaled."""
+        surface = cls.surface()
+        if cls.scale >= 1.0:
+            return surface
+
+        w, h = surface.get_size()
+        size = (max(1, int(w * cls.scale)), max(1, int(h * cls.scale)))
+        if cls._target is None or cls._target.get_size() != size:
+            cls._target = pygame.Surface(size).convert(surface)
+        return cls._target
+
+    @classmethod
+    def zoom(cls) -> float:
+        """Returns the size of a window pixel in the render target."""
+        if cls.scale >= 1.0:
+            return 1.0
+        return cls.target().get_width() / float(cls.size()[0])
+
+    @classmethod
+    def stretch(cls, source: pygame.Surface, surface: pygame.Surface) -> None:
+        """Scales a render target to the whole surface."""
+        if source is surface:
+            return
+        if cls.smooth and source.get_bitsize() >= 24:
+            pygame.transform.smoothscale(source, surface.get_size(), surface)
+        else:
+            pygame.transform.scale(source, surface.get_size(), surface)
+        cls.mark(surface, surface.get_rect())
+
+    @classmethod
+    def set_pipelined(cls, enabled: bool) -> None:
+        """Enables or disables the pipelined rendering, from the next scene on."""
+        cls.pipelined = enabled
+
+    @classmethod
+    def mark(cls, surface, rect) -> None:
+        """Reports an area of the given surface drawn in the current frame.
+
+        Only areas of the display surface are kept, and only in dirty mode."""
+        if cls.dirty_mode and rect is not None and surface is cls.surface():
+            cls._dirty.append(surface.get_rect().clip(rect))
+
     @classmethod
     def clear(cls, color=(0, 0, 0)) -> None:
-        cls.surface().fill(color)
+        """Fills the screen with a color or background surface.
+
+        In dirty mode, only the areas drawn in the previous frame are restored."""
+        surface = cls.surface()
+        if cls.dirty_mode and not cls._full:
+            areas = cls._previous
+        else:
+            areas = [surface.get_rect()]
+
+        if isinstance(color, pygame.Surface):
+            for rect in areas:
+                surface.blit(color, rect, rect)
+        else:
+            for rect in areas:
+                surface.fill(color, rect)
 
     @classmethod
     def on_screen(cls, fps=None) -> None:
-        if isinstance(fps, int):
-            cls.clock.tick(fps)
-        pygame.display.flip()
+        start = time.perf_counter()
+        FramePacer.tick(fps if isinstance(fps, int) and cls.limit_fps else None)
+        idle = cls.idle_time = time.perf_counter() - start
+
+        if cls.dirty_mode and not cls._full:
+            rects = cls._previous + cls._dirty
+            w, h = cls.size()
+            area = 0
+            for rect in rects:
+                area += rect.w * rect.h
+
+            # too many changes, a single flip is cheaper
+            if area > w * h * cls.dirty_limit:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+        else:
+            pygame.display.flip()
+
+        cls._full = False
+        cls._previous = cls._dirty
+        cls._dirty = []
+
+        cls._end_frame(idle)
+
+    @classmethod
+    def _end_frame(cls, idle: float) -> None:
+        now = time.perf_counter()
+        render_start = cls._render_start
+        if render_start is None or render_start < cls._frame_start:
+            cls.sim_time = now - cls._frame_start - idle
+            cls.render_time = 0.0
+        else:
+            cls.sim_time = render_start - cls._frame_start
+            cls.render_time = now - render_start - idle
+        cls._frame_start = now
+        cls._render_start = None
+
+        if cls.auto_scale:
+            cls._adjust_scale(cls.sim_time + cls.render_time)
+
+        if cls.on_frame is not None:
+            cls.on_frame()
+
+    @classmethod
+    def _adjust_scale(cls, frame_time: float) -> None:
+        # smoothed, so a single slow frame doesn't change the resolution
+        cls._load += (frame_time - cls._load) * 0.1
+        if cls._cooldown > 0:
+            cls._cooldown -= 1
+            return
+
+        if cls._load > cls.budget and cls.scale > cls.min_scale:
+            cls.set_scale(cls.scale - cls.scale_step)
+            cls._cooldown = 30
+        elif cls._load < cls.budget * 0.6 and cls.scale < 1.0:
+            cls.set_scale(cls.scale + cls.scale_step)
+            cls._cooldown = 60
 
 
 class Scene(object):
@@ -86,7 +353,23 @@ class Scene(object):
     @classmethod
     def goto(cls, scene) -> None:
         """Sets the next scene to be played."""
-        Game.scene = scene
+        Game.goto(scene)
+
+    @classmethod
+    def preload(cls) -> object:
+        """Prepares what the scene needs to play, such as images and rooms.
+
+        Called from a worker thread, while another scene may be playing; the
+        returned object is handed back by Game.preloaded(scene). It should
+        only read and decode files and build plain data: surfaces are converted,
+        and the display used, on the main thread (in play). Scenes that can't
+        be prepared ahead don't need to override it."""
+        return None
+
+    @classmethod
+    def progress(cls) -> float or None:
+        """Returns how much of the preloading is done, from 0 to 1, or None if unknown."""
+        return None
 
     # @classmethod
     # def get_current(cls) -> object:
@@ -0,0 +1,149 @@
+__author__ = 'Jorge'
+
+
+import math
+
+
+__all__ = [
+    "linear",
+    "quad_in",
+    "quad_out",
+    "quad_in_out",
+    "cubic_in",
+    "cubic_out",
+    "cubic_in_out",
+    "elastic_in",
+    "elastic_out",
+    "elastic_in_out",
+    "back_in",
+    "back_out",
+    "back_in_out",
+    "Easing"
+]
+
+
+# back easing overshoot constants
+BACK = 1.70158
+BACK_IN_OUT = BACK * 1.525
+
+# elastic easing period constants
+ELASTIC = (2 * math.pi) / 3
+ELASTIC_IN_OUT = (2 * math.pi) / 4.5
+
+
+def linear(t: float) -> float:
+    return t
+
+
+def quad_in(t: float) -> float:
+    return t * t
+
+
+def quad_out(t: float) -> float:
+    return 1 - (1 - t) * (1 - t)
+
+
+def quad_in_out(t: float) -> float:
+    if t < 0.5:
+        return 2 * t * t
+    return 1 - ((-2 * t + 2) ** 2) / 2
+
+
+def cubic_in(t: float) -> float:
+    return t * t * t
+
+
+def cubic_out(t: float) -> float:
+    return 1 - (1 - t) ** 3
+
+
+def cubic_in_out(t: float) -> float:
+    if t < 0.5:
+        return 4 * t * t * t
+    return 1 - ((-2 * t + 2) ** 3) / 2
+
+
+def elastic_in(t: float) -> float:
+    if t == 0.0 or t == 1.0:
+        return t
+    return -(2 ** (10 * t - 10)) * math.sin((t * 10 - 10.75) * ELASTIC)
+
+
+def elastic_out(t: float) -> float:
+    if t == 0.0 or t == 1.0:
+        return t
+    return (2 ** (-10 * t)) * math.sin((t * 10 - 0.75) * ELASTIC) + 1
+
+
+def elastic_in_out(t: float) -> float:
+    if t == 0.0 or t == 1.0:
+        return t
+    if t < 0.5:
+        return -((2 ** (20 * t - 10)) * math.sin((20 * t - 11.125) * ELASTIC_IN_OUT)) / 2
+    return ((2 ** (-20 * t + 10)) * math.sin((20 * t - 11.125) * ELASTIC_IN_OUT)) / 2 + 1
+
+
+def back_in(t: float) -> float:
+    return (BACK + 1) * t * t * t - BACK * t * t
+
+
+def back_out(t: float) -> float:
+    t -= 1
+    return 1 + (BACK + 1) * t * t * t + BACK * t * t
+
+
+def back_in_out(t: float) -> float:
+    if t < 0.5:
+        return ((2 * t) ** 2 * ((BACK_IN_OUT + 1) * 2 * t - BACK_IN_OUT)) / 2
+    return ((2 * t - 2) ** 2 * ((BACK_IN_OUT + 1) * (t * 2 - 2) + BACK_IN_OUT) + 2) / 2
+
+
+class Easing(object):
+
+    """An easing curve compiled into a lookup table.
+
+    Calling it with a ratio between 0 and 1 returns the eased ratio, read from
+    the table and interpolated between its two nearest entries. Elastic and back
+    curves return values outside of that range near the ends."""
+
+    __slots__ = ("function", "resolution", "table")
+
+    curves = {}
+
+    @classmethod
+    def register(cls, function, resolution: int=256) -> 'Easing':
+        """Compiles an easing function and makes it available by its name."""
+        curve = cls(function, resolution)
+        cls.curves[function.__name__] = curve
+        return curve
+
+    @classmethod
+    def get(cls, name: str) -> 'Easing':
+        """Returns the compiled curve with the given name."""
+        try:
+            return cls.curves[name]
+        except KeyError:
+            raise ValueError("There's no easing curve named '{}'.".format(name))
+
+    def __init__(self, function, resolution: int=256):
+        self.function = function
+        self.resolution = resolution
+        self.table = [function(i / float(resolution)) for i in range(resolution + 1)]
+
+    def __call__(self, ratio: float) -> float:
+        if ratio <= 0.0:
+            return self.table[0]
+        if ratio >= 1.0:
+            return self.table[-1]
+
+        i, r = divmod(ratio * self.resolution, 1.0)
+        i = int(i)
+        a = self.table[i]
+        return a + (self.table[i + 1] - a) * r
+
+
+for _function in (linear, quad_in, quad_out, quad_in_out, cubic_in, cubic_out, cubic_in_out,
+                  elastic_in, elastic_out, elastic_in_out, back_in, back_out, back_in_out):
+    Easing.register(_function)
+
+del _function
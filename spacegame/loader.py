@@ -0,0 +1,170 @@
+__author__ = 'Jorge'
+
+
+import threading
+import pygame
+from spacegame.resources import Resources
+
+
+__all__ = [
+    "IMAGE",
+    "ALPHA",
+    "PALETTE",
+    "MANIFEST",
+    "Asset",
+    "Loader"
+]
+
+
+# How the surfaces are prepared once there's a display
+IMAGE = 0       # converted to the display format
+ALPHA = 1       # converted to the display format, keeping the per pixel alpha
+PALETTE = 2     # kept as loaded, so the palette can still be changed (bitmap fonts)
+
+
+# The game assets, by name: (file name, mode)
+MANIFEST = {
+    "starfield": ("starfield.png", IMAGE),
+    "font.small": ("small_(5,2,6,12).png", PALETTE),
+    "font.medium": ("medium_(0,0,36,18).png", PALETTE),
+    "font.large": ("large_(0,0,64,32).png", PALETTE),
+}
+
+
+class Asset(object):
+
+    """A handle to an asset of the manifest.
+
+    The asset is only loaded when the handle is first resolved, and converted
+    to the display format as soon as there's a display. Handles can be resolved
+    from any thread."""
+
+    __slots__ = ("name", "filename", "mode", "_surface", "_converted", "_lock")
+
+    def __init__(self, name: str, filename: str, mode: int):
+        self.name = name
+        self.filename = filename
+        self.mode = mode
+        self._surface = None
+        self._converted = mode == PALETTE
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return "{}({!r}, {!r})".format(self.__class__.__qualname__, self.name, self.filename)
+
+    @property
+    def loaded(self) -> bool:
+        """Gets whether the asset was already loaded."""
+        return self._surface is not None
+
+    def load(self) -> pygame.Surface:
+        """Returns the asset surface, loading but not converting it if needed.
+
+        Unlike get, it doesn't need the display, so it can be called from any thread."""
+        surface = self._surface
+        if surface is not None:
+            return surface
+
+        with self._lock:
+            surface = self._surface
+            if surface is None:
+                surface = self._surface = Loader.load_file(self.filename)
+        return surface
+
+    def get(self) -> pygame.Surface:
+        """Returns the asset surface, loading and converting it if needed."""
+        surface = self._surface
+        if surface is not None and self._converted:
+            return surface
+
+        with self._lock:
+            surface = self._surface
+            if surface is None:
+                surface = self._surface = Loader.load_file(self.filename)
+
+            if not self._converted and pygame.display.get_surface() is not None:
+                if self.mode == ALPHA:
+                    surface = self._surface = surface.convert_alpha()
+                else:
+                    surface = self._surface = surface.convert()
+                self._converted = True
+
+        return surface
+
+    def release(self) -> None:
+        """Drops the loaded surface; it will be loaded again when needed."""
+        self._surface = None
+        self._converted = self.mode == PALETTE
+
+
+class Loader(object):
+
+    """The asset manager.
+
+    Assets are requested by their manifest name, and each asset and file is
+    loaded only once however many handles point to it."""
+
+    manifest = MANIFEST
+    handles = {}
+    files = {}
+
+    @classmethod
+    def handle(cls, name: str) -> Asset:
+        """Returns the handle of the asset with given name."""
+        asset = cls.handles.get(name)
+        if asset is None:
+            try:
+                filename, mode = cls.manifest[name]
+            except KeyError:
+                raise ValueError("There's no asset named '{}' in the manifest.".format(name))
+
+            asset = cls.handles[name] = Asset(name, filename, mode)
+
+        return asset
+
+    @classmethod
+    def get(cls, name: str) -> pygame.Surface:
+        """Returns the surface of the asset with given name."""
+        return cls.handle(name).get()
+
+    @classmethod
+    def load_file(cls, filename: str) -> pygame.Surface:
+        """Loads an image file from the resources (see Resources), once."""
+        surface = cls.files.get(filename)
+        if surface is None:
+            with Resources.open(filename) as stream:
+                surface = cls.files[filename] = pygame.image.load(stream, filename)
+
+        return surface
+
+    @classmethod
+    def preload(cls, names: list=None) -> None:
+        """Loads the given assets, or all of the manifest, up front."""
+        for name in cls.manifest if names is None else names:
+            cls.handle(name).get()
+
+    @classmethod
+    def decode(cls, names: list=None) -> None:
+        """Loads the given assets, or all of the manifest, without converting them (see Asset.load)."""
+        for name in cls.manifest if names is None else names:
+            cls.handle(name).load()
+
+    @classmethod
+    def prefetch(cls, names: list, executor) -> list:
+        """Loads the given assets with an executor (see concurrent.futures), without converting
+        them; returns the futures."""
+        return [executor.submit(cls.handle(name).load) for name in names]
+
+    @classmethod
+    def progress(cls, names: list) -> float:
+        """Returns the fraction of the given assets already loaded."""
+        if not names:
+            return 1.0
+        return sum(1 for name in names if cls.handle(name).loaded) / float(len(names))
+
+    @classmethod
+    def release(cls) -> None:
+        """Drops every loaded surface."""
+        for asset in cls.handles.values():
+            asset.release()
+        cls.files.clear()
@@ -0,0 +1,122 @@
+__author__ = 'Jorge'
+
+
+import time
+import pygame
+
+
+__all__ = [
+    "COSMETIC",
+    "OPTIONAL",
+    "FramePacer"
+]
+
+
+# Kinds of work that can be shed when the frames run long, shed first to last:
+COSMETIC = 1    # visual extras: particle emission, overlays
+OPTIONAL = 2    # work that can wait a frame: AI updates, text cache rebuilds
+
+
+class FramePacer(object):
+
+    """Waits for the next frame and keeps track of the frame time budget.
+
+    'precise' pacing waits with Clock.tick_busy_loop, which keeps the frame
+    rate steady at the cost of a busy CPU; otherwise Clock.tick sleeps, which
+    may overshoot by a millisecond or more.
+
+    The work done in each frame (everything but the wait) is measured against
+    the budget of 1 / fps seconds. When a frame runs long, the shedding level
+    rises at once and the kinds of work up to it are skipped (see allows);
+    after 'recover' frames with plenty of headroom it falls one level again."""
+
+    clock = pygame.time.Clock()
+    precise = False
+    fps = 60
+    budget = 1.0 / 60.0
+
+    # shedding thresholds, as fractions of the budget
+    high = 0.9
+    low = 0.6
+    recover = 60
+
+    level = 0
+    work_time = 0.0
+    load = 0.0
+    _frame_start = time.perf_counter()
+    _calm = 0
+
+    @classmethod
+    def set_precise(cls, precise: bool) -> None:
+        """Chooses between tick_busy_loop (precise) and tick."""
+        cls.precise = precise
+
+    @classmethod
+    def set_fps(cls, fps: int) -> None:
+        cls.fps = fps
+        cls.budget = 1.0 / fps
+
+    @classmethod
+    def elapsed(cls) -> float:
+        """Returns the seconds spent in the current frame so far."""
+        return time.perf_counter() - cls._frame_start
+
+    @classmethod
+    def remaining(cls) -> float:
+        """Returns the seconds left in the budget of the current frame (negative if over)."""
+        return cls.budget - (time.perf_counter() - cls._frame_start)
+
+    @classmethod
+    def can_afford(cls, seconds: float) -> bool:
+        """Tells whether work taking the given seconds still fits in the current frame."""
+        return cls.remaining() >= seconds
+
+    @classmethod
+    def allows(cls, kind: int) -> bool:
+        """Tells whether a kind of work (COSMETIC, OPTIONAL) should be done this frame."""
+        return kind > cls.level
+
+    @classmethod
+    def tick(cls, fps: int=None) -> int:
+        """Ends the current frame: updates the budget and waits for the next frame.
+
+        Without fps, it doesn't wait. Returns the milliseconds since the previous tick."""
+        if fps is not None and fps != cls.fps:
+            cls.set_fps(fps)
+
+        cls.work_time = time.perf_counter() - cls._frame_start
+        cls._shed(cls.work_time)
+
+        if fps is None:
+            ms = cls.clock.tick()
+        elif cls.precise:
+            ms = cls.clock.tick_busy_loop(fps)
+        else:
+            ms = cls.clock.tick(fps)
+
+        cls._frame_start = time.perf_counter()
+        return ms
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.level = 0
+        cls.load = 0.0
+        cls._calm = 0
+        cls._frame_start = time.perf_counter()
+
+    @classmethod
+    def _shed(cls, work: float) -> None:
+        cls.load += (work - cls.load) * 0.1
+        budget = cls.budget
+
+        if work > budget * cls.high:
+            # running long: shed more right away, before the simulation falls behind
+            cls.level = min(OPTIONAL, cls.level + 1)
+            cls._calm = 0
+        elif cls.load < budget * cls.low:
+            cls._calm += 1
+            if cls._calm >= cls.recover and cls.level > 0:
+                cls.level -= 1
+                cls._calm = 0
+        else:
+            cls._calm = 0
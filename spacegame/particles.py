@@ -0,0 +1,171 @@
+__author__ = 'Jorge'
+
+
+import math
+import numpy
+import pygame
+from spacegame.renderer import draw
+
+
+__all__ = [
+    "ParticleSystem"
+]
+
+
+class ParticleSystem(object):
+
+    """A pool of particles kept in preallocated numpy arrays.
+
+    Live particles are packed at the start of the arrays, so integration is a
+    handful of vectorized operations over slices; dead particles are replaced by
+    the live ones past them, through preallocated buffers, and new ones are
+    written after the last live one. Updating doesn't allocate arrays.
+    Positions are in world units, velocities in world units per second.
+
+    One pixel particles are written straight into the target pixels (lightening
+    them); larger ones are blitted from cached square sprites."""
+
+    def __init__(self, capacity: int=65536, drag: float=0.5, seed: int=None):
+        self.capacity = capacity
+        self.drag = drag
+        self.count = 0
+        self.random = numpy.random.default_rng(seed)
+
+        self.position = numpy.zeros((capacity, 2), numpy.float32)
+        self.velocity = numpy.zeros((capacity, 2), numpy.float32)
+        self.life = numpy.zeros(capacity, numpy.float32)
+        self.lifetime = numpy.ones(capacity, numpy.float32)
+        self.color = numpy.zeros((capacity, 3), numpy.uint8)
+        self.size = numpy.ones(capacity, numpy.uint8)
+
+        self._alive = numpy.zeros(capacity, bool)
+        self._dead = numpy.zeros(capacity, bool)
+        self._step = numpy.zeros((capacity, 2), numpy.float32)
+        self._index = numpy.arange(capacity, dtype=numpy.intp)
+        self._holes = numpy.zeros(capacity, numpy.intp)
+        self._moved = numpy.zeros(capacity, numpy.intp)
+        # room for the moved rows of the widest array (position and velocity)
+        self._rows = numpy.zeros(capacity * 8, numpy.uint8)
+        self._sprites = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def emit(self, count: int, position, velocity=(0.0, 0.0), angle: float=0.0, spread: float=180.0,
+             speed=(0.0, 50.0), life=(0.5, 1.0), color=(255, 255, 255), size: int=1) -> int:
+        """Adds particles at a position, moving in random directions within 'spread'
+        degrees of 'angle', plus the given velocity.
+
+        'speed' and 'life' are (minimum, maximum) ranges. Returns the number of
+        particles added, which is less than 'count' if the pool is full."""
+        start = self.count
+        count = min(count, self.capacity - start)
+        if count <= 0:
+            return 0
+        end = start + count
+
+        rnd = self.random
+        angles = numpy.radians(angle + rnd.uniform(-spread, spread, count))
+        speeds = rnd.uniform(speed[0], speed[1], count)
+        self.position[start:end] = position
+        self.velocity[start:end, 0] = numpy.cos(angles) * speeds + velocity[0]
+        self.velocity[start:end, 1] = numpy.sin(angles) * speeds + velocity[1]
+        self.lifetime[start:end] = rnd.uniform(life[0], life[1], count)
+        self.life[start:end] = self.lifetime[start:end]
+        self.color[start:end] = color
+        self.size[start:end] = size
+
+        self.count = end
+        return count
+
+    def update(self, seconds: float) -> None:
+        """Moves the particles and drops the dead ones."""
+        n = self.count
+        if n == 0 or seconds <= 0.0:
+            return
+
+        velocity = self.velocity[:n]
+        step = self._step[:n]
+        numpy.multiply(velocity, seconds, out=step)
+        self.position[:n] += step
+        if self.drag:
+            velocity *= math.pow(self.drag, seconds)
+        self.life[:n] -= seconds
+
+        alive = self._alive[:n]
+        numpy.greater(self.life[:n], 0.0, out=alive)
+        live = int(numpy.count_nonzero(alive))
+        if live == n:
+            return
+
+        # the dead among the first 'live' slots are filled with the live ones after them
+        dead = self._dead[:live]
+        numpy.logical_not(alive[:live], out=dead)
+        moves = int(numpy.count_nonzero(dead))
+        if moves:
+            holes = numpy.compress(dead, self._index[:live], out=self._holes[:moves])
+            moved = numpy.compress(alive[live:], self._index[live:n], out=self._moved[:moves])
+            for array in (self.position, self.velocity, self.life, self.lifetime, self.color, self.size):
+                rows = self._rows[:moves * array[0].nbytes].view(array.dtype).reshape((moves,) + array.shape[1:])
+                numpy.take(array, moved, axis=0, out=rows)
+                array[holes] = rows
+        self.count = live
+
+    def clear(self) -> None:
+        self.count = 0
+
+    def render(self, surface, view) -> None:
+        """Draws the particles onto the surface (or records it, for a RenderQueue), as seen by the view."""
+        n = self.count
+        if n == 0:
+            return
+
+        zoom = view.zoom
+        x = ((self.position[:n, 0] - view.position.x) * zoom).astype(numpy.int32)
+        y = ((self.position[:n, 1] - view.position.y) * zoom).astype(numpy.int32)
+
+        # the color fades out with the life left
+        fade = self.life[:n] / self.lifetime[:n]
+        colors = (self.color[:n] * fade[:, None]).astype(numpy.uint8)
+
+        sizes = self.size[:n]
+        points = sizes <= 1
+        if points.all():
+            draw(surface, self.write_pixels, x, y, colors)
+            return
+
+        draw(surface, self.write_pixels, x[points], y[points], colors[points])
+        large = ~points
+        draw(surface, self.blit_sprites, x[large], y[large], colors[large], (sizes[large] * zoom).astype(numpy.int32))
+
+    @staticmethod
+    def write_pixels(surface: pygame.Surface, x, y, colors) -> pygame.Rect:
+        """Lightens the pixels at (x, y) with the given colors.
+
+        Surfaces of less than 24 bits are drawn one pixel at a time."""
+        w, h = surface.get_size()
+        inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        x, y, colors = x[inside], y[inside], colors[inside]
+        if surface.get_bitsize() < 24:
+            for px, py, color in zip(x.tolist(), y.tolist(), colors.tolist()):
+                surface.set_at((px, py), color)
+        else:
+            pixels = pygame.surfarray.pixels3d(surface)
+            pixels[x, y] = numpy.maximum(pixels[x, y], colors)
+            del pixels
+        return surface.get_rect()
+
+    def blit_sprites(self, surface: pygame.Surface, x, y, colors, sizes) -> pygame.Rect:
+        """Blits a square sprite for each particle, additively, with colors quantized to 16 levels."""
+        sprites = self._sprites
+        blits = []
+        for px, py, color, size in zip(x.tolist(), y.tolist(), (colors >> 4).tolist(), sizes.tolist()):
+            key = (size, tuple(color))
+            sprite = sprites.get(key)
+            if sprite is None:
+                sprite = sprites[key] = pygame.Surface((max(1, size), max(1, size)))
+                sprite.fill([c * 17 for c in color])
+            half = size >> 1
+            blits.append((sprite, (px - half, py - half), None, pygame.BLEND_RGB_ADD))
+        surface.blits(blits, False)
+        return surface.get_rect()
@@ -0,0 +1,152 @@
+__author__ = 'Jorge'
+
+
+import time
+import threading
+import pygame
+from spacegame.core import Display
+from spacegame.renderer import RenderQueue
+
+
+__all__ = [
+    "Compositor"
+]
+
+
+class Compositor(object):
+
+    """Composites recorded frames on a worker thread, into offscreen buffers.
+
+    The main thread records frame N+1 into a RenderQueue and hands it over with
+    submit(), while the worker draws it into one of two offscreen surfaces; the
+    main thread then simulates the next frame and only has to present the
+    finished buffer. pygame releases the GIL while blitting, so the drawing
+    overlaps with the simulation. A separate world frame, when given, is drawn
+    into a render target at the internal resolution and stretched to the buffer
+    first (see Display.set_scale).
+
+    Only frozen frames reach the worker: cached surfaces a frame blits (text, ui
+    layer, parallax background) are only changed while recording, and wait()
+    makes sure the worker is done with the previous frame before that.
+
+    An error raised while compositing a frame is kept and raised again by the
+    next wait(), on the main thread; the worker goes on with the next frame."""
+
+    def __init__(self, size: tuple=None, background=(0, 0, 0)):
+        self.background = background
+        self.buffers = []
+        self.target = None
+        self.resize(size or Display.size())
+
+        # statistics of the last frame
+        self.draws = 0
+        self.submits = 0
+        self.render_time = 0.0
+        self.wait_time = 0.0
+
+        self._frame = None
+        self._world = None
+        self._buffer = 0
+        self._ready = None
+        self._error = None
+        self._pending = threading.Event()
+        self._finished = threading.Event()
+        self._finished.set()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="compositor", daemon=True)
+        self._thread.start()
+
+    def resize(self, size: tuple) -> None:
+        """Creates the offscreen buffers, in the display format."""
+        self.buffers = [pygame.Surface(size) for _ in range(2)]
+        if pygame.display.get_surface() is not None:
+            self.buffers = [buffer.convert() for buffer in self.buffers]
+
+    def submit(self, queue: RenderQueue, world: RenderQueue=None) -> None:
+        """Hands the frame recorded in the queue to the worker, and clears the queue.
+
+        Call wait() first: only one frame is composited at a time."""
+        self.wait()
+        if not self._running:
+            raise RuntimeError("The compositor was stopped.")
+        if world is not None:
+            size = Display.target().get_size()
+            if self.target is None or self.target.get_size() != size:
+                self.target = pygame.Surface(size, 0, self.buffers[0])
+            self._world = world.freeze()
+        else:
+            self._world = None
+        self._frame = queue.freeze()
+        self._buffer ^= 1
+        self._finished.clear()
+        self._pending.set()
+
+    def wait(self) -> pygame.Surface or None:
+        """Waits for the frame being composited and returns its buffer.
+
+        Returns None if no frame was submitted since the last call. Raises the
+        error the worker ran into, if the frame couldn't be composited."""
+        start = time.perf_counter()
+        self._finished.wait()
+        self.wait_time = time.perf_counter() - start
+
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+        ready, self._ready = self._ready, None
+        return ready
+
+    def present(self, buffer: pygame.Surface, fps=None) -> None:
+        """Copies a finished buffer to the screen and shows it."""
+        Display.surface().blit(buffer, (0, 0))
+        Display.on_screen(fps)
+
+    def stop(self) -> None:
+        """Finishes the frame being composited and ends the worker thread."""
+        try:
+            self.wait()
+        finally:
+            self._running = False
+            self._pending.set()
+            self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                self._pending.wait()
+                self._pending.clear()
+                if not self._running:
+                    return
+
+                start = time.perf_counter()
+                frame, self._frame = self._frame, None
+                world, self._world = self._world, None
+                buffer = self.buffers[self._buffer]
+                try:
+                    if world is None:
+                        self._clear(buffer)
+                        self.submits = RenderQueue.submit(buffer, frame)
+                        self.draws = len(frame)
+                    else:
+                        self._clear(self.target)
+                        self.submits = RenderQueue.submit(self.target, world)
+                        Display.stretch(self.target, buffer)
+                        self.submits += RenderQueue.submit(buffer, frame)
+                        self.draws = len(world) + len(frame)
+                    self._ready = buffer
+                except Exception as error:
+                    self._error = error
+                finally:
+                    self.render_time = time.perf_counter() - start
+                    self._finished.set()
+        finally:
+            # wait() must never block on a thread that isn't running
+            self._running = False
+            self._finished.set()
+
+    def _clear(self, surface: pygame.Surface) -> None:
+        if isinstance(self.background, pygame.Surface):
+            surface.blit(self.background, (0, 0))
+        else:
+            surface.fill(self.background)
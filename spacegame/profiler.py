@@ -0,0 +1,200 @@
+__author__ = 'Jorge'
+
+
+import csv
+import time
+from collections import deque
+from collections import OrderedDict
+import pygame
+import pygame.locals as c
+from spacegame.core import Display
+from spacegame.ui import BitmapFont
+
+
+__all__ = [
+    "PHASES",
+    "Profiler"
+]
+
+
+# The phases of a frame, in order. Each mark() charges the time since the
+# previous mark to the given phase; with a RenderQueue, the render phases
+# (parallax, actors, ui) only record, and 'composite' draws.
+PHASES = [
+    "input",        # pygame events and ui dispatching
+    "streaming",    # loading and unloading chunks
+    "events",       # actors events and keys
+    "view",         # View.animate
+    "animate",      # actor animations and particles
+    "motion",       # actor motion and update
+    "collision",
+    "visibility",
+    "prerender",
+    "parallax",
+    "actors",
+    "ui",
+    "composite",    # RenderQueue flush or the pipelined compositor
+    "flip",         # Display.on_screen, without the frame rate wait
+    "idle",         # the frame rate wait
+]
+
+
+class Profiler(object):
+
+    """Times the phases of each frame.
+
+    Scenes call begin_frame() and end_frame() around each frame, and code calls
+    mark(phase) at the end of each phase. Rolling statistics are kept for the
+    last 'window' frames, shown by an overlay toggled with 'hotkey', and each
+    frame can be streamed as a row of a CSV file. While disabled, mark() only
+    checks a flag."""
+
+    enabled = False
+    overlay = False
+    hotkey = c.K_F3
+    window = 300
+    refresh = 15
+
+    times = OrderedDict()
+    frames = 0
+    _frame = {}
+    _last = 0
+    _image = None
+    _csv = None
+    _writer = None
+
+    @classmethod
+    def enable(cls, enabled: bool=True) -> None:
+        cls.enabled = enabled
+        cls._frame = {}
+        cls._last = time.perf_counter_ns()
+
+    @classmethod
+    def reset(cls) -> None:
+        """Drops the collected statistics."""
+        cls.times.clear()
+        cls.frames = 0
+        cls._image = None
+
+    @classmethod
+    def begin_frame(cls) -> None:
+        if cls.enabled:
+            cls._frame = {}
+            cls._last = time.perf_counter_ns()
+
+    @classmethod
+    def mark(cls, phase: str) -> None:
+        """Charges the time since the previous mark to a phase of the current frame."""
+        if not cls.enabled:
+            return
+        now = time.perf_counter_ns()
+        frame = cls._frame
+        frame[phase] = frame.get(phase, 0) + now - cls._last
+        cls._last = now
+
+    @classmethod
+    def end_frame(cls) -> None:
+        """Closes the frame: the time since the last mark is charged to the flip."""
+        if not cls.enabled:
+            return
+        cls.mark("flip")
+
+        frame = cls._frame
+        idle = int(Display.idle_time * 1e9)
+        if idle:
+            idle = min(idle, frame["flip"])
+            frame["flip"] -= idle
+            frame["idle"] = idle
+
+        frame["frame"] = sum(frame.values())
+        times = cls.times
+        for phase, ns in frame.items():
+            samples = times.get(phase)
+            if samples is None:
+                samples = times[phase] = deque(maxlen=cls.window)
+            samples.append(ns)
+
+        cls.frames += 1
+        if cls._writer is not None:
+            cls._writer.writerow([cls.frames] + [frame.get(phase, 0) for phase in PHASES + ["frame"]])
+
+        if cls.overlay and cls.frames % cls.refresh == 1:
+            cls._image = cls.render_report()
+
+        cls._frame = {}
+
+    @classmethod
+    def stats(cls, phase: str) -> dict:
+        """Returns the mean, 95th and 99th percentiles and maximum of a phase, in milliseconds."""
+        samples = sorted(cls.times.get(phase, ()))
+        if not samples:
+            return {"mean": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+
+        n = len(samples)
+        return {
+            "mean": sum(samples) / n / 1e6,
+            "p95": samples[min(n - 1, int(n * 0.95))] / 1e6,
+            "p99": samples[min(n - 1, int(n * 0.99))] / 1e6,
+            "max": samples[-1] / 1e6,
+        }
+
+    @classmethod
+    def report(cls) -> list:
+        """Returns the statistics as lines of text, one per phase."""
+        lines = ["{:<11}{:>7}{:>7}{:>7}{:>7}".format("ms", "mean", "p95", "p99", "max")]
+        for phase in cls.times:
+            stats = cls.stats(phase)
+            lines.append("{:<11}{:>7.2f}{:>7.2f}{:>7.2f}{:>7.2f}".format(
+                phase, stats["mean"], stats["p95"], stats["p99"], stats["max"]))
+        return lines
+
+    @classmethod
+    def process_events(cls, events: list) -> None:
+        """Toggles the overlay (and the profiling along with it) on the hotkey."""
+        for event in events:
+            if event.type == c.KEYDOWN and event.key == cls.hotkey:
+                cls.overlay = not cls.overlay
+                if cls.overlay and not cls.enabled:
+                    cls.enable(True)
+                elif not cls.overlay and cls._writer is None:
+                    cls.enable(False)
+                cls._image = cls.render_report() if cls.overlay else None
+
+    @classmethod
+    def render_report(cls) -> pygame.Surface:
+        """Renders the report into a new surface.
+
+        The numbers change all the time, so the lines aren't kept in the text cache."""
+        lines = cls.report()
+        font = BitmapFont.small
+        w, h = BitmapFont.measure(max(lines, key=len), font, (0, 0))[2:]
+        image = pygame.Surface((w, h * len(lines)))
+        if pygame.display.get_surface() is not None:
+            image = image.convert()
+        BitmapFont.set_colors(font, (0, 0, 0), (255, 255, 0))
+        for n, line in enumerate(lines):
+            BitmapFont.render(image, line, font, (0, n * h), cached=False)
+        return image
+
+    @classmethod
+    def render(cls, surface, position: tuple=(8, 40)) -> None:
+        """Draws the overlay, if shown."""
+        if cls.overlay and cls._image is not None:
+            surface.blit(cls._image, position)
+            Display.mark(surface, cls._image.get_rect(topleft=position))
+
+    @classmethod
+    def open_csv(cls, filename: str) -> None:
+        """Streams a row per frame, with the time of each phase in nanoseconds, to a CSV file."""
+        cls.close_csv()
+        cls._csv = open(filename, "w", newline="")
+        cls._writer = csv.writer(cls._csv)
+        cls._writer.writerow(["frame"] + PHASES + ["frame_ns"])
+        cls.enable(True)
+
+    @classmethod
+    def close_csv(cls) -> None:
+        if cls._csv is not None:
+            cls._csv.close()
+            cls._csv = None
+            cls._writer = None
@@ -0,0 +1,135 @@
+__author__ = 'Jorge'
+
+
+import time
+from operator import itemgetter
+import pygame
+from spacegame.core import Display
+
+
+__all__ = [
+    "RenderQueue",
+    "draw"
+]
+
+
+def draw(target, function, *args) -> pygame.Rect or None:
+    """Calls a pygame drawing function on a surface, or records it if the target is a RenderQueue.
+
+    Returns the rect the function touched, or None when recorded."""
+    if isinstance(target, RenderQueue):
+        target.draw(function, *args)
+        return None
+    return function(target, *args)
+
+
+class RenderQueue(object):
+
+    """Records the drawing commands of a frame and submits them all at once.
+
+    It has the blit and blits methods of a pygame.Surface, so it can be given to
+    any render method in place of the screen; other drawing functions are
+    recorded through draw(). Each command has a layer, the current 'layer' if
+    not given. On flush, commands are sorted by layer and blend flag, keeping
+    the recording order within each group, and each run of blits is submitted
+    with a single Surface.blits call."""
+
+    # the sort key; the sort is stable, so overlapping commands keep their order
+    order = itemgetter(0, 1)
+
+    def __init__(self):
+        self.commands = []
+        self.layer = 0
+
+        # statistics of the last flush
+        self.draws = 0
+        self.submits = 0
+        self.render_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def blit(self, source: pygame.Surface, dest, area=None, special_flags: int=0, layer: int=None) -> None:
+        """Records a blit."""
+        self.commands.append((
+            self.layer if layer is None else layer, special_flags, True, source, dest, area
+        ))
+
+    def blits(self, blit_sequence, doreturn: bool=True, layer: int=None) -> None:
+        """Records a sequence of (source, dest[, area[, special_flags]]) blits."""
+        for item in blit_sequence:
+            self.blit(*item, layer=layer)
+
+    def draw(self, function, *args, layer: int=None) -> None:
+        """Records a call to function(surface, *args), such as pygame.draw.polygon.
+
+        List arguments are copied, so they can be changed after recording."""
+        self.commands.append((
+            self.layer if layer is None else layer, 0, False,
+            function, tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args), None
+        ))
+
+    def clear(self) -> None:
+        """Drops the recorded commands."""
+        del self.commands[:]
+        self.layer = 0
+
+    def freeze(self) -> list:
+        """Returns the recorded commands, sorted for submission, and clears the queue.
+
+        The returned frame no longer depends on the queue, so it can be submitted
+        later, or from another thread, with RenderQueue.submit."""
+        commands = self.commands
+
+        commands.sort(key=RenderQueue.order)
+        self.commands = []
+        self.layer = 0
+        return commands
+
+    def flush(self, surface: pygame.Surface) -> int:
+        """Submits the recorded commands to the surface and clears the queue.
+
+        Returns the number of submissions (blits batches plus drawing calls)."""
+        start = time.perf_counter()
+        commands = self.freeze()
+        self.submits = self.submit(surface, commands)
+        self.draws = len(commands)
+        self.render_time = time.perf_counter() - start
+
+        return self.submits
+
+    @classmethod
+    def submit(cls, surface: pygame.Surface, commands: list) -> int:
+        """Draws a frozen frame onto the surface, batching consecutive blits.
+
+        Returns the number of submissions (blits batches plus drawing calls)."""
+        mark = Display.dirty_mode
+        batch = []
+        submits = 0
+        for command in commands:
+            if command[2]:
+                # (source, dest, area, special_flags)
+                batch.append((command[3], command[4], command[5], command[1]))
+                continue
+
+            if batch:
+                cls._submit(surface, batch, mark)
+                submits += 1
+                batch = []
+
+            function, args = command[3], command[4]
+            Display.mark(surface, function(surface, *args))
+            submits += 1
+
+        if batch:
+            cls._submit(surface, batch, mark)
+            submits += 1
+
+        return submits
+
+    @staticmethod
+    def _submit(surface: pygame.Surface, batch: list, mark: bool) -> None:
+        rects = surface.blits(batch, mark)
+        if mark:
+            for rect in rects:
+                Display.mark(surface, rect)
@@ -0,0 +1,247 @@
+"""Resource files, from the resources folder or from a packed archive.
+
+The resources can be packed into a single file, a zip file or a SGPK blob,
+which is mounted instead of the folder:
+
+    python -m spacegame.resources [--output res.sgpk] [folder]
+
+A SGPK blob is a header, the files one after the other, and an index of
+them at the end. All numbers are little endian:
+
+    header: magic b"SGPK", version (uint16), file count (uint16), index offset (uint64)
+    entry:  name length (uint16), data offset (uint64), data size (uint64), name (utf-8)
+"""
+
+__author__ = 'Jorge'
+
+
+import io
+import os
+import sys
+import mmap
+import struct
+import zipfile
+import argparse
+import threading
+from spacegame.core import resource
+
+
+__all__ = [
+    "SGPK",
+    "PackArchive",
+    "ZipArchive",
+    "Resources"
+]
+
+
+SGPK = b"SGPK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQ")
+ENTRY = struct.Struct("<HQQ")
+
+
+class PackArchive(object):
+
+    """A SGPK blob, memory mapped: reading a file is slicing the map.
+
+    An empty file is an empty archive (an empty file can't be mapped)."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index = {}
+        self._map = None
+        with open(filename, "rb") as stream:
+            if os.fstat(stream.fileno()).st_size == 0:
+                return
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, offset = HEADER.unpack_from(self._map, 0)
+        if magic != SGPK or version != VERSION:
+            self._map.close()
+            raise ValueError("'{}' isn't a SGPK version {} file.".format(filename, VERSION))
+
+        for _ in range(count):
+            length, start, size = ENTRY.unpack_from(self._map, offset)
+            offset += ENTRY.size
+            name = self._map[offset:offset + length].decode("utf-8")
+            offset += length
+            self.index[name] = (start, size)
+
+    def names(self) -> list:
+        return list(self.index)
+
+    def read(self, name: str) -> bytes:
+        start, size = self.index[name]
+        return self._map[start:start + size]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+
+    @staticmethod
+    def pack(files: dict, filename: str) -> None:
+        """Writes a SGPK blob with the given files, as {name: bytes}."""
+        with open(filename, "wb") as stream:
+            stream.write(HEADER.pack(SGPK, VERSION, 0, 0))
+            index = []
+            for name, data in files.items():
+                index.append((name.encode("utf-8"), stream.tell(), len(data)))
+                stream.write(data)
+
+            offset = stream.tell()
+            for name, start, size in index:
+                stream.write(ENTRY.pack(len(name), start, size))
+                stream.write(name)
+
+            stream.seek(0)
+            stream.write(HEADER.pack(SGPK, VERSION, len(index), offset))
+
+
+class ZipArchive(object):
+
+    """A zip file, memory mapped: stored files are read by slicing the map,
+    compressed ones are inflated by zipfile."""
+
+    LOCAL = struct.Struct("<4s22xHH")
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._zip = zipfile.ZipFile(filename)
+        self._map = mmap.mmap(self._zip.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._lock = threading.Lock()
+        self.index = {info.filename: info for info in self._zip.infolist() if not info.is_dir()}
+
+    def names(self) -> list:
+        return list(self.index)
+
+    def read(self, name: str) -> bytes:
+        info = self.index[name]
+        if info.compress_type == zipfile.ZIP_STORED:
+            # the data follows the local header, whose name and extra field may differ from the index
+            magic, length, extra = self.LOCAL.unpack_from(self._map, info.header_offset)
+            start = info.header_offset + self.LOCAL.size + length + extra
+            return self._map[start:start + info.file_size]
+
+        # zipfile seeks the file, so it's read by a thread at a time
+        with self._lock:
+            return self._zip.read(info)
+
+    def close(self) -> None:
+        self._map.close()
+        self._zip.close()
+
+    @staticmethod
+    def pack(files: dict, filename: str) -> None:
+        """Writes a zip file with the given files, as {name: bytes}, stored (images are compressed already)."""
+        with zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+
+
+class Resources(object):
+
+    """The resource files manager.
+
+    Files are read from the mounted archive, if any, or from the resources
+    folder. Unless one is mounted explicitly, the first of 'packs' found next
+    to the resources folder is mounted the first time a file is needed."""
+
+    packs = ["res.sgpk", "res.zip"]
+    archive = None
+    _searched = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def mount(cls, filename: str) -> None:
+        """Reads the resources from an archive (a SGPK blob or a zip file)."""
+        cls.unmount()
+        if zipfile.is_zipfile(filename):
+            cls.archive = ZipArchive(filename)
+        else:
+            cls.archive = PackArchive(filename)
+        cls._searched = True
+
+    @classmethod
+    def unmount(cls) -> None:
+        """Goes back to the resources folder."""
+        if cls.archive is not None:
+            cls.archive.close()
+            cls.archive = None
+
+    @classmethod
+    def mounted(cls):
+        """Returns the mounted archive, looking for one the first time; None if there's none."""
+        if not cls._searched:
+            # assets may be loaded by the preloading threads
+            with cls._lock:
+                if not cls._searched:
+                    folder = os.path.dirname(resource(""))
+                    for name in cls.packs:
+                        filename = os.path.join(os.path.dirname(folder), name)
+                        if os.path.isfile(filename):
+                            cls.mount(filename)
+                            break
+                    cls._searched = True
+        return cls.archive
+
+    @classmethod
+    def exists(cls, name: str) -> bool:
+        archive = cls.mounted()
+        if archive is not None:
+            return name in archive.index
+        return os.path.isfile(resource(name))
+
+    @classmethod
+    def read(cls, name: str) -> bytes:
+        """Returns the contents of a resource file."""
+        archive = cls.mounted()
+        if archive is None:
+            with open(resource(name), "rb") as stream:
+                return stream.read()
+
+        try:
+            return archive.read(name)
+        except KeyError:
+            raise FileNotFoundError("There's no resource named '{}' in '{}'.".format(name, archive.filename))
+
+    @classmethod
+    def open(cls, name: str):
+        """Returns a binary file object to read a resource file."""
+        if cls.mounted() is None:
+            return open(resource(name), "rb")
+        return io.BytesIO(cls.read(name))
+
+    @classmethod
+    def pack(cls, filename: str, folder: str=None) -> int:
+        """Packs the files of the resources folder into an archive: a zip file if
+        its name ends in .zip, a SGPK blob otherwise. Returns the number of files."""
+        folder = folder or os.path.dirname(resource(""))
+        files = {}
+        for name in sorted(os.listdir(folder)):
+            full = os.path.join(folder, name)
+            if os.path.isfile(full):
+                with open(full, "rb") as stream:
+                    files[name] = stream.read()
+
+        if filename.lower().endswith(".zip"):
+            ZipArchive.pack(files, filename)
+        else:
+            PackArchive.pack(files, filename)
+        return len(files)
+
+
+def main(argv: list=None) -> int:
+    parser = argparse.ArgumentParser(prog="spacegame.resources", description="Packs the resource files.")
+    parser.add_argument("folder", nargs="?", help="the resources folder (the game's, by default)")
+    parser.add_argument("--output", "-o", help="the archive to write, .zip or .sgpk (res.sgpk next to the folder)")
+    args = parser.parse_args(argv)
+
+    folder = args.folder or os.path.dirname(resource(""))
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(folder)), Resources.packs[0])
+    count = Resources.pack(output, folder)
+    print("{} files packed into {}".format(count, output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,7 +8,11 @@ from spacegame.ui import Anchor
 from spacegame.geometry import *
 from spacegame.core import Scene
 from spacegame.core import Display
-from spacegame.core import resource
+from spacegame.loader import Loader
+from spacegame.renderer import RenderQueue
+from spacegame.pipeline import Compositor
+from spacegame.profiler import Profiler
+from spacegame.pacing import FramePacer, COSMETIC, OPTIONAL
 from spacegame.assets import *
 from spacegame.actors import *
 from spacegame.vectors import Vector
@@ -55,21 +59,31 @@ class SceneMain(Scene):
         textcolor = (128, 0, 0)
         fillcolor = (32, 0, 0)
         BitmapFont.set_colors(BitmapFont.large, fillcolor, textcolor)
+        Display.set_dirty_mode(True)
+
+        # the game is likely next: it's prepared while the menu shows
+        game.preload(SceneGame)
 
         while game.scene is cls:
+            Profiler.begin_frame()
             events = pygame.event.get()
             keys = pygame.key.get_pressed()
+            Profiler.process_events(events)
             dispatcher.process_events(events, keys, game)
+            Profiler.mark("input")
 
+            Display.begin_render()
             Display.clear(fillcolor)
             surface = Display.surface()
 
             BitmapFont.render(surface, "Main", BitmapFont.large, (0, 0), c.BLEND_RGB_ADD)
 
-            for gui in dispatcher.listeners:
-                gui.basic_render(surface)
+            dispatcher.render(surface)
+            Profiler.render(surface)
+            Profiler.mark("ui")
 
             Display.on_screen(30)
+            Profiler.end_frame()
 
 
 class SceneOption(Scene):
@@ -100,20 +114,27 @@ class SceneOption(Scene):
         textcolor = (0, 128, 128)
         fillcolor = (0, 32, 32)
         BitmapFont.set_colors(BitmapFont.large, fillcolor, textcolor)
+        Display.set_dirty_mode(True)
 
         while game.scene is cls:
+            Profiler.begin_frame()
             events = pygame.event.get()
             keys = pygame.key.get_pressed()
+            Profiler.process_events(events)
             dispatcher.process_events(events, keys, game)
+            Profiler.mark("input")
 
+            Display.begin_render()
             Display.clear(fillcolor)
             surface = Display.surface()
 
             BitmapFont.render(surface, "Options", BitmapFont.large, (0, 0))
-            for gui in dispatcher.listeners:
-                gui.basic_render(surface)
+            dispatcher.render(surface)
+            Profiler.render(surface)
+            Profiler.mark("ui")
 
             Display.on_screen(30)
+            Profiler.end_frame()
 
 
 class SceneGame(Scene):
@@ -134,6 +155,7 @@ class SceneGame(Scene):
         def on_keydown(self, keys: tuple, game: type, room: Room) -> None:
             if keys[c.K_w]:
                 self.motion_add(0.1, self.rotation)
+                self.exhaust(room)
             if keys[c.K_a]:
                 self.rotation = (self.rotation + 4) % 360
             if keys[c.K_d]:
@@ -144,6 +166,36 @@ class SceneGame(Scene):
         def on_prerender(self, game: type, room: 'Room') -> None:
             room.view.follow(self.position)
 
+        def exhaust(self, room: Room) -> None:
+            """Emits the thrust particles behind the ship, unless the frames run long."""
+            if room.particles is None or not FramePacer.allows(COSMETIC):
+                return
+            dx, dy = lengthdir(self.scale.x * 0.3, self.rotation)
+            # actors move once per frame, at 60 frames per second
+            room.particles.emit(
+                40, (self.position.x - dx, self.position.y - dy), (self.motion.x * 60, self.motion.y * 60),
+                self.rotation + 180, 15, (60, 240), (0.2, 0.6), (255, 160, 48)
+            )
+
+    # the manifest assets the scene needs
+    assets = ["starfield"]
+
+    @classmethod
+    def create_room(cls) -> Room:
+        """Returns the room to be played."""
+        return Room([
+            cls.Starship(Vector(300, 200), 0, Vector(50, 50))
+        ])
+
+    @classmethod
+    def preload(cls) -> None:
+        """Reads and decodes the assets; they're converted when the room is built."""
+        Loader.decode(cls.assets)
+
+    @classmethod
+    def progress(cls) -> float:
+        return Loader.progress(cls.assets)
+
     @classmethod
     def play(cls, game: type) -> None:
 
@@ -152,30 +204,99 @@ class SceneGame(Scene):
                 SceneOption.BackButton(Vec(100, 540), Vec(100, 40), "Back", None)
             ]
         )
-        room = Room([
-            cls.Starship(Vector(300, 200), 0, Vector(50, 50))
-        ])
+        # waits for the assets, if they're still being decoded, and raises the preloading errors
+        game.preloaded(cls)
+        room = cls.create_room()
 
         textcolor = (0, 0, 92)
         fillcolor = (0, 0, 16)
         BitmapFont.set_colors(BitmapFont.large, fillcolor, textcolor)
 
-        while game.scene is cls:
-            Display.clear(fillcolor)
-            surface = Display.surface()
-
-            events = pygame.event.get()
-            keys = pygame.key.get_pressed()
-            dispatcher.process_events(events, keys, game)
-            room.update(events, keys, room.view, game)
-
-            BitmapFont.render(surface, "Game", BitmapFont.large, (0, 0))
-
-            room.view.render(surface)
-            for actor in room.actors:
-                actor.default_render(surface, room.view)
-
-            for gui in dispatcher.listeners:
-                gui.basic_render(surface)
-
-            Display.on_screen(60)
+        # the scrolling background changes the whole screen every frame
+        Display.set_dirty_mode(False)
+
+        # the frame is recorded and drawn at once, by layers; when the render
+        # resolution is scaled, the world is recorded apart and drawn into the render target
+        queue = RenderQueue()
+        world = RenderQueue()
+
+        # pipelined: frame N is composited by a worker thread while frame N+1 is simulated
+        compositor = Compositor(Display.size(), fillcolor) if Display.pipelined else None
+
+        try:
+            while game.scene is cls:
+                Profiler.begin_frame()
+                scaled = Display.scale < 1.0
+                if compositor is None and not scaled:
+                    Display.clear(fillcolor)
+                    Profiler.mark("composite")
+
+                events = pygame.event.get()
+                keys = pygame.key.get_pressed()
+                Profiler.process_events(events)
+                dispatcher.process_events(events, keys, game)
+                Profiler.mark("input")
+                room.update(events, keys, room.view, game)
+
+                Display.begin_render()
+
+                # the cached surfaces may only change once the worker is done with them
+                frame = compositor.wait() if compositor is not None else None
+                Profiler.mark("composite")
+
+                # the text is drawn at the window resolution: under the world (the starfield
+                # adds up over it), or, when scaled, over the world stretched into the window
+                queue.layer = 0
+                BitmapFont.render(queue, "Game", BitmapFont.large, (0, 0))
+                room.render_debug(queue)
+                Profiler.mark("ui")
+
+                layers = world if scaled else queue
+                layers.layer = 1
+                room.view.render(layers)
+                Profiler.mark("parallax")
+
+                layers.layer = 2
+                if room.particles is not None and FramePacer.allows(OPTIONAL):
+                    room.particles.render(layers, room.view)
+                for actor in room.visible:
+                    actor.default_render(layers, room.view)
+                Profiler.mark("actors")
+
+                queue.layer = 3
+                dispatcher.render(queue)
+                queue.layer = 4
+                Profiler.render(queue)
+                Profiler.mark("ui")
+
+                if compositor is None:
+                    surface = Display.surface()
+                    if scaled:
+                        target = Display.target()
+                        target.fill(fillcolor)
+                        world.flush(target)
+                        Display.stretch(target, surface)
+                    queue.flush(surface)
+                    Profiler.mark("composite")
+                    Display.on_screen(60)
+                else:
+                    compositor.submit(queue, world if scaled else None)
+                    Profiler.mark("composite")
+                    if frame is not None:
+                        compositor.present(frame, 60)
+                Profiler.end_frame()
+        finally:
+            # the scene's workers end with it, even when the scene ends with an error
+            try:
+                if compositor is not None:
+                    try:
+                        # the last frame submitted is still shown
+                        frame = compositor.wait()
+                        if frame is not None:
+                            compositor.present(frame)
+                    finally:
+                        compositor.stop()
+            finally:
+                if room.streamer is not None:
+                    # the chunks stored by the scene go with it
+                    room.streamer.stop()
@@ -0,0 +1,100 @@
+__author__ = 'Jorge'
+
+
+__all__ = [
+    "SpatialGrid"
+]
+
+
+class SpatialGrid(object):
+
+    """A uniform grid of square cells bucketing objects by their bounding boxes.
+
+    Boxes are (left, top, right, bottom) tuples. An object is kept in every cell
+    its box touches, and only changes cells when its box crosses a cell border."""
+
+    def __init__(self, cell_size: float=128.0):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.boxes = {}
+        self.ranges = {}
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __contains__(self, obj) -> bool:
+        return obj in self.boxes
+
+    def cell_range(self, box: tuple) -> tuple:
+        """Returns the (left, top, right, bottom) indices of the cells touched by a box."""
+        size = self.cell_size
+        return (int(box[0] // size), int(box[1] // size),
+                int(box[2] // size), int(box[3] // size))
+
+    def insert(self, obj, box: tuple) -> None:
+        """Adds an object with the given bounding box."""
+        if obj in self.boxes:
+            self.update(obj, box)
+            return
+
+        rng = self.cell_range(box)
+        self.boxes[obj] = box
+        self.ranges[obj] = rng
+        cells = self.cells
+        for cx in range(rng[0], rng[2] + 1):
+            for cy in range(rng[1], rng[3] + 1):
+                cell = cells.get((cx, cy))
+                if cell is None:
+                    cell = cells[(cx, cy)] = set()
+                cell.add(obj)
+
+    def update(self, obj, box: tuple) -> None:
+        """Changes the bounding box of an object."""
+        rng = self.cell_range(box)
+        if self.ranges.get(obj) == rng:
+            self.boxes[obj] = box
+            return
+
+        self.remove(obj)
+        self.insert(obj, box)
+
+    def remove(self, obj) -> None:
+        """Removes an object from the grid."""
+        rng = self.ranges.pop(obj, None)
+        if rng is None:
+            return
+
+        del self.boxes[obj]
+        cells = self.cells
+        for cx in range(rng[0], rng[2] + 1):
+            for cy in range(rng[1], rng[3] + 1):
+                cell = cells[(cx, cy)]
+                cell.discard(obj)
+                if not cell:
+                    del cells[(cx, cy)]
+
+    def query(self, box: tuple) -> set:
+        """Returns the objects whose bounding boxes overlap the given box."""
+        left, top, right, bottom = box
+        rng = self.cell_range(box)
+        cells = self.cells
+        boxes = self.boxes
+        found = set()
+        for cx in range(rng[0], rng[2] + 1):
+            for cy in range(rng[1], rng[3] + 1):
+                cell = cells.get((cx, cy))
+                if cell is None:
+                    continue
+                for obj in cell:
+                    if obj in found:
+                        continue
+                    b = boxes[obj]
+                    if b[0] <= right and left <= b[2] and b[1] <= bottom and top <= b[3]:
+                        found.add(obj)
+
+        return found
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.boxes.clear()
+        self.ranges.clear()
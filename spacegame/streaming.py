@@ -0,0 +1,337 @@
+__author__ = 'Jorge'
+
+
+import os
+import zlib
+import pickle
+import tempfile
+import threading
+from queue import Queue
+
+
+__all__ = [
+    "ChunkStore",
+    "ChunkStreamer"
+]
+
+
+class ChunkStore(object):
+
+    """Keeps the actors of each chunk in a file of a directory, compressed.
+
+    Actors are kept as their class and what Actor.get_data returns: plain data
+    and their path animations. Without a directory, the chunks go to a new
+    temporary one."""
+
+    def __init__(self, directory: str=None, level: int=6):
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="spacegame-chunks-")
+        self.directory = directory
+        self.level = level
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, key: tuple) -> str:
+        return os.path.join(self.directory, "chunk_{}_{}.bin".format(*key))
+
+    def dumps(self, actors: list) -> bytes:
+        """Serializes a list of actors."""
+        return pickle.dumps([(type(actor), actor.get_data()) for actor in actors], pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes) -> list:
+        """Returns new actors from serialized ones."""
+        return [cls.from_data(state) for cls, state in pickle.loads(data)] if data else []
+
+    def save(self, key: tuple, data: bytes) -> None:
+        """Compresses and writes serialized actors; empty chunks have no file."""
+        filename = self.filename(key)
+        if not data:
+            if os.path.exists(filename):
+                os.remove(filename)
+            return
+
+        # written aside and renamed, so a chunk file is never read half written
+        temp = filename + ".tmp"
+        with open(temp, "wb") as stream:
+            stream.write(zlib.compress(data, self.level))
+        os.replace(temp, filename)
+
+    def read(self, key: tuple) -> bytes:
+        """Returns the serialized actors of a chunk, or empty bytes if it was never saved."""
+        try:
+            with open(self.filename(key), "rb") as stream:
+                return zlib.decompress(stream.read())
+        except FileNotFoundError:
+            return b""
+
+    def load(self, key: tuple) -> list:
+        """Reads the actors of a chunk, or an empty list if it was never saved."""
+        return self.loads(self.read(key))
+
+    def append(self, key: tuple, data: bytes) -> None:
+        """Adds serialized actors to a chunk, without making actors of the ones saved."""
+        saved = self.read(key)
+        records = pickle.loads(saved) if saved else []
+        self.save(key, pickle.dumps(records + pickle.loads(data), pickle.HIGHEST_PROTOCOL))
+
+    def remove(self) -> None:
+        """Deletes the chunk files, and the directory if nothing else is left in it."""
+        for name in os.listdir(self.directory):
+            if name.startswith("chunk_") and name.endswith((".bin", ".tmp")):
+                os.remove(os.path.join(self.directory, name))
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+
+class ChunkStreamer(object):
+
+    """Keeps only the chunks of a room near its view loaded and simulated.
+
+    The world is split in square chunks of 'chunk_size' units. The chunks
+    within 'radius' chunks of the view area are resident: their actors are in
+    the room. Chunks past 'radius' + 1 are unloaded: their actors are removed from
+    the room and saved to the store. The chunks ahead of the view's motion are
+    read and unpickled by a background thread, so they're usually ready when
+    needed; a resident chunk that isn't ready yet is loaded on the spot, once
+    the background tasks for that chunk, if any, are done.
+
+    Every update, the streamed actors that moved to another chunk change
+    buckets; the ones that moved out of the resident chunks are saved with
+    the chunk they're in.
+
+    Only the actors given to add_actors or loaded from the store are streamed;
+    other actors of the room (the player's) stay resident. Actors with state
+    Actor.get_data doesn't keep are refused (TypeError) before anything changes."""
+
+    def __init__(self, room, store: ChunkStore, chunk_size: float=1024.0, radius: int=1, lookahead: int=30):
+        self.room = room
+        self.store = store
+        self.chunk_size = float(chunk_size)
+        self.radius = radius
+        self.lookahead = lookahead
+
+        # the streamed actors of each resident chunk, and the chunk of each streamed actor
+        self.chunks = {}
+        self.actors = {}
+
+        # statistics
+        self.loads = 0
+        self.unloads = 0
+        self.prefetches = 0
+        self.stalls = 0
+        self.moves = 0
+
+        self._ready = {}
+        self._requested = set()
+        # the number of queued tasks for each chunk; _done is notified when a chunk has none left
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._tasks = Queue()
+        self._thread = threading.Thread(target=self._run, name="streamer", daemon=True)
+        self._thread.start()
+
+        room.streamer = self
+
+    def chunk_of(self, position) -> tuple:
+        """Returns the key of the chunk containing a position."""
+        size = self.chunk_size
+        return int(position[0] // size), int(position[1] // size)
+
+    def chunks_around(self, box: tuple, radius: int) -> set:
+        """Returns the keys of the chunks within 'radius' chunks of a (left, top, right, bottom) box."""
+        left, top = self.chunk_of(box[:2])
+        right, bottom = self.chunk_of(box[2:])
+        return {(x, y) for x in range(left - radius, right + radius + 1)
+                for y in range(top - radius, bottom + radius + 1)}
+
+    def add_actors(self, actors: list) -> None:
+        """Adds actors to the world: to the room if their chunk is resident, to the store otherwise."""
+        stored = {}
+        resident = []
+        for actor in actors:
+            key = self.chunk_of(actor.position)
+            if key in self.chunks:
+                resident.append((actor, key))
+            else:
+                stored.setdefault(key, []).append(actor)
+
+        # serialized first, so an actor that can't be stored is refused before anything changes
+        for actor, _ in resident:
+            actor.get_data()
+        stored = {key: self.store.dumps(chunk) for key, chunk in stored.items()}
+
+        for actor, key in resident:
+            self.chunks[key].add(actor)
+            self.actors[actor] = key
+        self.room.add_actors([actor for actor, _ in resident])
+        for key, data in stored.items():
+            self._store(key, data)
+
+    def update(self, view) -> None:
+        """Loads the chunks near the view, unloads the distant ones and prefetches the ones ahead."""
+        self._rebucket()
+
+        x, y = view.position
+        w, h = view.size
+        box = (x, y, x + w, y + h)
+
+        wanted = self.chunks_around(box, self.radius)
+        for key in wanted - self.chunks.keys():
+            self._load(key)
+
+        keep = self.chunks_around(box, self.radius + 1)
+        distant = self.chunks.keys() - keep
+        if distant:
+            self._unload(distant)
+
+        # where the view will be if it keeps moving
+        ahead = set()
+        mx, my = view.motion
+        if mx or my:
+            dx, dy = mx * self.lookahead, my * self.lookahead
+            ahead = self.chunks_around((x + dx, y + dy, x + w + dx, y + h + dy), self.radius) - self.chunks.keys()
+            for key in ahead - self._requested:
+                self._requested.add(key)
+                self.prefetches += 1
+                self._put(self._prefetch, key, None)
+
+        # prefetched chunks the view turned away from
+        stale = self._requested - keep - ahead
+        if stale:
+            self._requested -= stale
+            with self._lock:
+                for key in stale:
+                    self._ready.pop(key, None)
+
+    def flush(self) -> None:
+        """Waits for the background thread to finish its pending reads and writes."""
+        self._tasks.join()
+
+    def stop(self, keep: bool=False) -> None:
+        """Ends the background thread.
+
+        With 'keep', every chunk is unloaded and saved to the store first;
+        otherwise the store is removed, and the resident actors are left in the room."""
+        if keep:
+            self._unload(set(self.chunks))
+        self.flush()
+        self._tasks.put(None)
+        self._thread.join()
+        if not keep:
+            self.store.remove()
+        self.chunks.clear()
+        self.actors.clear()
+        if self.room.streamer is self:
+            self.room.streamer = None
+
+    def _rebucket(self) -> None:
+        moved = []
+        chunk_of = self.chunk_of
+        for actor, key in self.actors.items():
+            new = chunk_of(actor.position)
+            if new != key:
+                moved.append((actor, key, new))
+        if not moved:
+            return
+
+        strays = {}
+        for actor, old, new in moved:
+            self.chunks[old].discard(actor)
+            bucket = self.chunks.get(new)
+            if bucket is not None:
+                bucket.add(actor)
+                self.actors[actor] = new
+            else:
+                # out of the resident chunks: saved with the chunk it's in now
+                del self.actors[actor]
+                strays.setdefault(new, []).append(actor)
+        self.moves += len(moved)
+
+        for key, actors in strays.items():
+            data = self.store.dumps(actors)
+            self.room.remove_actors(actors)
+            self._store(key, data)
+
+    def _store(self, key: tuple, data: bytes) -> None:
+        # the actors are serialized by the caller, while nothing changes them
+        self._discard(key)
+        self._put(self._append, key, data)
+
+    def _discard(self, key: tuple) -> None:
+        # a prefetched copy of a chunk about to be written is stale
+        self._requested.discard(key)
+        with self._lock:
+            self._ready.pop(key, None)
+
+    def _load(self, key: tuple) -> None:
+        with self._lock:
+            if key in self._pending:
+                # still being written or prefetched: only the tasks for this chunk are waited for
+                if key not in self._ready:
+                    self.stalls += 1
+                self._done.wait_for(lambda: key not in self._pending)
+            actors = self._ready.pop(key, None)
+
+        if actors is None:
+            actors = self.store.load(key)
+
+        self._requested.discard(key)
+        self.chunks[key] = set(actors)
+        self.loads += 1
+        for actor in actors:
+            self.actors[actor] = key
+        if actors:
+            self.room.add_actors(actors)
+
+    def _unload(self, keys: set) -> None:
+        for key in keys:
+            # serialized now, before the chunk goes; compressed and written in the background
+            actors = list(self.chunks[key])
+            data = self.store.dumps(actors) if actors else b""
+            del self.chunks[key]
+            if actors:
+                self.room.remove_actors(actors)
+                for actor in actors:
+                    del self.actors[actor]
+
+            self.unloads += 1
+            self._discard(key)
+            self._put(self._save, key, data)
+
+    def _put(self, function, key: tuple, data: bytes) -> None:
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        self._tasks.put((function, key, data))
+
+    def _prefetch(self, key: tuple, _) -> None:
+        actors = self.store.load(key)
+        with self._lock:
+            if key in self._requested:
+                self._ready[key] = actors
+
+    def _save(self, key: tuple, data: bytes) -> None:
+        self.store.save(key, data)
+
+    def _append(self, key: tuple, data: bytes) -> None:
+        self.store.append(key, data)
+
+    def _run(self) -> None:
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                function, key, data = task
+                try:
+                    function(key, data)
+                finally:
+                    with self._lock:
+                        count = self._pending.pop(key) - 1
+                        if count:
+                            self._pending[key] = count
+                        else:
+                            self._done.notify_all()
+            finally:
+                self._tasks.task_done()
@@ -2,14 +2,26 @@ __author__ = 'Jorge'
 
 
 from enum import Enum
+from collections import OrderedDict
 import pygame
 import pygame.locals as c
-from spacegame.core import resource
+from spacegame.core import Display
+from spacegame.loader import Loader
+from spacegame.renderer import draw
+from spacegame.pacing import FramePacer, OPTIONAL
 from spacegame.geometry import Vec
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __all__ = [
     "BitmapFont",
+    "FontFace",
+    "TextCache",
     "blend_color",
+    "blend_palette",
     "Anchor",
     "UIElement",
     "Button",
@@ -25,7 +37,13 @@ CEL = 3     # the tile size (w, h)
 GRD = 4     # the tile grid size (w, h)
 GLY = 5     # the glyph position and size in the tile region (x, y, w, h)
 CHR = 6     # the characters contained in the font (a string)
-BFC = 7     # the current background and foreground colors wich the surface palette was blended into
+BFC = 7     # the current background and foreground colors wich the surface palette was blended into (None: never blended)
+PLC = 8     # the palettes already blended, by (background, foreground) colors
+ATL = 9     # the glyph atlas: the (x, y, w, h) region of each character in the surface
+SRC = 10    # the asset handle of the resource surface
+
+# the number of blended palettes kept per font
+PALETTE_CACHE_SIZE = 32
 
 
 # Font alignment constants
@@ -41,6 +59,20 @@ class Anchor(Enum):
     bottom_right = 9
 
 
+# the fraction of the text size to move it by, for each anchor
+ANCHOR_OFFSETS = {
+    Anchor.top_left: (0.0, 0.0),
+    Anchor.top: (0.5, 0.0),
+    Anchor.top_right: (1.0, 0.0),
+    Anchor.middle_left: (0.0, 0.5),
+    Anchor.middle: (0.5, 0.5),
+    Anchor.middle_right: (1.0, 0.5),
+    Anchor.bottom_left: (0.0, 1.0),
+    Anchor.bottom: (0.5, 1.0),
+    Anchor.bottom_right: (1.0, 1.0)
+}
+
+
 def normalize_color(color) -> tuple:
     """Normalizes the components of the given color."""
     return (
@@ -61,56 +93,166 @@ def blend_color(a, b, ratio) -> tuple:
     )
 
 
+def blend_palette(normalized, a, b) -> list:
+    """Blends and returns a whole palette of colors a and b, to the ratios of the given normalized palette."""
+    if numpy is None:
+        return [blend_color(a, b, ratio) for ratio in normalized]
+
+    a = numpy.array(a[:3], dtype=float)
+    b = numpy.array(b[:3], dtype=float)
+    colors = (a + (b - a) * numpy.array(normalized, dtype=float)).astype(int)
+    return [tuple(color) for color in colors.tolist()]
+
+
+def glyph_atlas(font) -> dict:
+    """Returns the (x, y, w, h) region of each character of the font in its surface."""
+    cols = font[GRD][0]
+    cw, ch = font[CEL]
+    gx, gy, gw, gh = font[GLY]
+    atlas = {}
+    for ind, char in enumerate(font[CHR]):
+        row, col = divmod(ind, cols)
+        atlas.setdefault(char, (col * cw + gx, row * ch + gy, gw, gh))
+
+    return atlas
+
+
+class TextCache(object):
+
+    """Keeps rendered text surfaces for BitmapFont.render.
+
+    Entries are keyed by (text, font, colors). When they hold more than 'capacity'
+    pixels, the least recently used are dropped."""
+
+    capacity = 1 << 21
+    entries = OrderedDict()
+    pixels = 0
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, key: tuple) -> pygame.Surface or None:
+        """Returns the surface cached under the given key, if any."""
+        surface = cls.entries.get(key)
+        if surface is None:
+            cls.misses += 1
+            return None
+
+        cls.entries.move_to_end(key)
+        cls.hits += 1
+        return surface
+
+    @classmethod
+    def put(cls, key: tuple, surface: pygame.Surface) -> None:
+        """Caches a surface, dropping the oldest ones if the cache gets too large."""
+        w, h = surface.get_size()
+        if w * h > cls.capacity:
+            return
+
+        if key in cls.entries:
+            old = cls.entries.pop(key)
+            cls.pixels -= old.get_width() * old.get_height()
+
+        cls.entries[key] = surface
+        cls.pixels += w * h
+
+        while cls.pixels > cls.capacity:
+            old = cls.entries.popitem(last=False)[1]
+            cls.pixels -= old.get_width() * old.get_height()
+
+    @classmethod
+    def clear(cls) -> None:
+        cls.entries.clear()
+        cls.pixels = 0
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Returns the cache usage counters."""
+        lookups = cls.hits + cls.misses
+        return {
+            'entries': len(cls.entries),
+            'pixels': cls.pixels,
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'hit_ratio': cls.hits / float(lookups) if lookups else 0.0
+        }
+
+
+class FontFace(dict):
+
+    """A bitmap font description.
+
+    Its surface (and the palettes taken from it) is only loaded from the asset
+    handle the first time it is used."""
+
+    def __missing__(self, key):
+        if key not in (BMP, PAL, NRM):
+            raise KeyError(key)
+
+        src = self[SRC].get()
+        self[BMP] = src
+        self[PAL] = src.get_palette()
+        self[NRM] = tuple(normalize_color(col) for col in self[PAL])
+        return self[key]
+
+
 class BitmapFont(object):
 
-    src = pygame.image.load(resource("small_(5,2,6,12).png"))
-    small = {
-        BMP: src,
-        PAL: src.get_palette(),
-        NRM: tuple(normalize_color(col) for col in src.get_palette()),
+    small = FontFace({
+        SRC: Loader.handle("font.small"),
         CEL: (16, 16),
         GRD: (32, 7),
         GLY: (5, 2, 6, 12),
         CHR: " !\"#$%&\'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~_¡¢£¤¥¦§¨©ª«¬­®¯°±²³´µ¶·¸¹º»¼½¾¿ÀÁÂÃÄÅÆÇÈÉÊËÌÍÎÏÐÑÒÓÔÕÖ×ØÙÚÛÜÝÞßàáâãäåæçèéêëìíîïðñòóôõö÷øùúûüýþÿ",
-        BFC: ((0, 0, 0), (255, 255, 255))
-    }
-    src = pygame.image.load(resource("medium_(0,0,36,18).png"))
-    medium = {
-        BMP: src,
-        PAL: src.get_palette(),
-        NRM: tuple(normalize_color(col) for col in src.get_palette()),
+        BFC: None,
+        PLC: {}
+    })
+    medium = FontFace({
+        SRC: Loader.handle("font.medium"),
         CEL: (16, 36),
         GRD: (32, 7),
         GLY: (0, 0, 16, 36),
         CHR: " !\"#$%&\'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~_¡¢£¤¥¦§¨©ª«¬­®¯°±²³´µ¶·¸¹º»¼½¾¿ÀÁÂÃÄÅÆÇÈÉÊËÌÍÎÏÐÑÒÓÔÕÖ×ØÙÚÛÜÝÞßàáâãäåæçèéêëìíîïðñòóôõö÷øùúûüýþÿ",
-        BFC: ((0, 0, 0), (255, 255, 255))
-    }
-    src = pygame.image.load(resource("large_(0,0,64,32).png"))
-    large = {
-        BMP: src,
-        PAL: src.get_palette(),
-        NRM: tuple(normalize_color(col) for col in src.get_palette()),
+        BFC: None,
+        PLC: {}
+    })
+    large = FontFace({
+        SRC: Loader.handle("font.large"),
         CEL: (32, 64),
         GRD: (32, 7),
         GLY: (0, 0, 32, 64),
         CHR: " !\"#$%&\'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~_¡¢£¤¥¦§¨©ª«¬­®¯°±²³´µ¶·¸¹º»¼½¾¿ÀÁÂÃÄÅÆÇÈÉÊËÌÍÎÏÐÑÒÓÔÕÖ×ØÙÚÛÜÝÞßàáâãäåæçèéêëìíîïðñòóôõö÷øùúûüýþÿ",
-        BFC: ((0, 0, 0), (255, 255, 255))
-    }
-    del src
+        BFC: None,
+        PLC: {}
+    })
+
+    small[ATL] = glyph_atlas(small)
+    medium[ATL] = glyph_atlas(medium)
+    large[ATL] = glyph_atlas(large)
 
     @classmethod
     def set_colors(cls, font, background, foreground) -> None:
         """Set the font palette colors to given colors."""
+        colors = (tuple(background), tuple(foreground))
+        if font[BFC] == colors:
+            return
 
-        for index in range(256):
-            color = blend_color(background, foreground, font[NRM][index])
-            font[BMP].set_palette_at(index, color)
+        palettes = font[PLC]
+        palette = palettes.get(colors)
+        if palette is None:
+            palette = blend_palette(font[NRM], background, foreground)
+            if len(palettes) >= PALETTE_CACHE_SIZE:
+                del palettes[next(iter(palettes))]
+            palettes[colors] = palette
 
-        font[BFC] = (background, foreground)
+        font[BMP].set_palette(palette)
+        font[BFC] = colors
 
     @classmethod
     def get_colors(cls, font) -> tuple:
-        """Returns the current background and foreground colors of the given font palette."""
+        """Returns the current background and foreground colors of the given font palette.
+
+        None until the colors are first set: the surface keeps the palette it was loaded with."""
 
         return font[BFC]
 
@@ -120,46 +262,68 @@ class BitmapFont(object):
         x, y = position
         w = font[GLY][2] * len(text)
         h = font[GLY][3]
+        fx, fy = ANCHOR_OFFSETS.get(anchor, (0.0, 0.0))
 
-        # faster and prettier than if/elif chains
-        rct = {
-            Anchor.top_left: (x, y, w, h),
-            Anchor.top: (x - (w / 2), y, w, h),
-            Anchor.top_right:  (x - (w / 2), y - h, w, h),
-            Anchor.middle_left: (x, y - (h / 2), w, h),
-            Anchor.middle: (x - (w / 2), y - (h / 2), w, h),
-            Anchor.middle_right: (x - w, y - (h / 2), w, h),
-            Anchor.bottom_left: (x, y - h, w, h),
-            Anchor.bottom: (x - (w / 2), y - h, w, h),
-            Anchor.bottom_right: (x - w, y - h, w, h)
-        }
-
-        if anchor in rct:
-            return rct[anchor]
-        return rct[Anchor.top_left]
+        return x - w * fx, y - h * fy, w, h
 
     @classmethod
-    def render(cls, surface, text, font, position, anchor=Anchor.top_left, blend=0) -> None:
-        """Renders the given text str with the given font at the given position."""
+    def render(cls, surface, text, font, position, anchor=Anchor.top_left, blend=0, cached=True) -> None:
+        """Renders the given text str with the given font at the given position.
+
+        Unless 'cached' is False, the text is rendered once per font and colors
+        into a surface kept in the TextCache, and blitted from there. Uncached
+        text recorded into a RenderQueue is rendered into a surface of its own,
+        as the font palette may change before the queue is drawn."""
         x, y, w, h = cls.measure(text, font, position, anchor)
-        gw = font[GLY][2]
-        gh = font[GLY][3]
+        Display.mark(surface, (x, y, w, h))
 
-        for n, char in enumerate(text):
-            if char in font[CHR]:
-                ind = font[CHR].index(char)
+        if w == 0:
+            return
+
+        if not cached:
+            if isinstance(surface, pygame.Surface):
+                cls.render_glyphs(surface, text, font, (x, y), blend)
             else:
-                ind = 0
+                surface.blit(cls.render_image(text, font, (w, h)), (x, y), None, blend)
+            return
 
-            # the char glyph tile x,y position in the grid
-            tile = Vec.swap_xy(divmod(ind, font[GRD][0]))
+        key = (text, id(font), font[BFC])
+        image = TextCache.get(key)
+        if image is None:
+            if not FramePacer.allows(OPTIONAL) and isinstance(surface, pygame.Surface):
+                # the frames run long: the cache entry can be built later (a RenderQueue
+                # needs it all the same, to keep the glyphs in the current colors)
+                cls.render_glyphs(surface, text, font, (x, y), blend)
+                return
+            image = cls.render_image(text, font, (w, h))
+            TextCache.put(key, image)
 
-            gx = (tile.x * font[CEL][0]) + font[GLY][0]
-            gy = (tile.y * font[CEL][1]) + font[GLY][1]
+        surface.blit(image, (x, y), None, blend)
+
+    @classmethod
+    def render_image(cls, text, font, size) -> pygame.Surface:
+        """Renders the given text, in the current font colors, into a new surface of given size."""
+        image = pygame.Surface(size, 0, font[BMP])
+        image.set_palette(font[BMP].get_palette())
+        cls.render_glyphs(image, text, font, (0, 0))
+        if pygame.display.get_surface() is not None:
+            image = image.convert()
+        return image
+
+    @classmethod
+    def render_glyphs(cls, surface, text, font, position, blend=0) -> None:
+        """Renders the given text glyph by glyph, with its top left corner at the given position."""
+        x, y = position
+        gw = font[GLY][2]
+        bmp = font[BMP]
+        atlas = font[ATL]
 
-            surface.blit(font[BMP], (x, y), (gx, gy, gw, gh), blend)
+        # unknown characters are drawn with the first glyph
+        blank = atlas[font[CHR][0]]
 
-            x += gw
+        surface.blits([
+            (bmp, (x + gw * n, y), atlas.get(char, blank), blend) for n, char in enumerate(text)
+        ], False)
 
 
 class UIElement(object):
@@ -193,12 +357,15 @@ class UIElement(object):
     def __init__(self, position, size):
         self._pos = Vec(*position)
         self._size = Vec(*size)
-        self.label = "uielmt"
+        self._label = "uielmt"
+        self._visible = True
+        self._hover = False
         self.icon = None
         self.command = None
         self.active = True
-        self.visible = True
-        self.hover = False
+
+        # whether the look of this element changed since it was last rendered by its dispatcher
+        self.dirty = True
 
         # the initialization
         self.on_initialize()
@@ -211,6 +378,7 @@ class UIElement(object):
     @pos.setter
     def pos(self, value):
         self._pos = Vec(*value)
+        self.dirty = True
 
     @property
     def size(self):
@@ -220,28 +388,53 @@ class UIElement(object):
     @size.setter
     def size(self, value):
         self._size = Vec(*value)
+        self.dirty = True
+
+    @property
+    def label(self) -> str:
+        """Gets or sets the text of this ui element."""
+        return self._label
+
+    @label.setter
+    def label(self, value) -> None:
+        if value != self._label:
+            self._label = value
+            self.dirty = True
+
+    @property
+    def visible(self) -> bool:
+        """Gets or sets whether this ui element is displayed."""
+        return self._visible
+
+    @visible.setter
+    def visible(self, value) -> None:
+        if value != self._visible:
+            self._visible = value
+            self.dirty = True
+
+    @property
+    def hover(self) -> bool:
+        """Gets or sets whether the mouse is over this ui element."""
+        return self._hover
+
+    @hover.setter
+    def hover(self, value) -> None:
+        if value != self._hover:
+            self._hover = value
+            self.dirty = True
 
     def get_anchor_pos(self, anchor) -> Vec:
         """Returns a point relative to the given anchor"""
-        x, y = self.pos
-        w, h = self.size
+        x, y = self._pos
+        w, h = self._size
+        fx, fy = ANCHOR_OFFSETS.get(anchor, (0.0, 0.0))
+        return Vec(x + w * fx, y + h * fy)
 
-        # faster and prettier than if/elif chains
-        rct = {
-            Anchor.top_left: Vec(x, y),
-            Anchor.top: Vec(x + (w / 2), y),
-            Anchor.top_right:  Vec(x + (w / 2), y + h),
-            Anchor.middle_left: Vec(x, y + (h / 2)),
-            Anchor.middle: Vec(x + (w / 2), y + (h / 2)),
-            Anchor.middle_right: Vec(x + w, y + (h / 2)),
-            Anchor.bottom_left: Vec(x, y + h),
-            Anchor.bottom: Vec(x + (w / 2), y + h),
-            Anchor.bottom_right: Vec(x + w, y + h)
-        }
-
-        if anchor in rct:
-            return rct[anchor]
-        return rct[Anchor.top_left]
+    def get_rect(self) -> pygame.Rect:
+        """Returns the area covered by this object's box, including its outline."""
+        x, y = self._pos
+        w, h = self._size
+        return pygame.Rect(int(x), int(y), int(w) + 2, int(h) + 2)
 
     def contains_point(self, point) -> bool:
         """Returns whether the given point is inside this object's bounds."""
@@ -304,20 +497,27 @@ class UIElement(object):
     def on_text(self, char: str, game: type):
         """Called when a printable character is pressed in the keyboard."""
 
-    def basic_render(self, surface) -> None:
-        """Displays this object with default rendering"""
+    def basic_render(self, surface) -> pygame.Rect or None:
+        """Displays this object with default rendering.
+
+        Returns the area covered by the box and the label, or None if not visible."""
         if not self.visible:
-            return
+            return None
         l, t = self.pos
-        r, b = self.get_anchor_pos(Anchor.bottom_right)
-        tpos = self.get_anchor_pos(Anchor.middle)
+        w, h = self.size
+        r, b = l + w, t + h
+        tpos = (l + w / 2, t + h / 2)
         backcolor = (128, 128, 128)
         forecolor = {False: (255, 255, 192), True: (255, 0, 0)}
         pts = ((l, t), (r, t), (r, b), (l, b))
-        pygame.draw.polygon(surface, backcolor, pts, 0)
-        pygame.draw.polygon(surface, forecolor[self.hover], pts, 1)
+        rect = draw(surface, pygame.draw.polygon, backcolor, pts, 0)
+        outline = draw(surface, pygame.draw.polygon, forecolor[self.hover], pts, 1)
+        if rect is not None:
+            Display.mark(surface, rect.union(outline))
+        text = str(self.label)
         BitmapFont.set_colors(BitmapFont.medium, backcolor, forecolor[self.hover])
-        BitmapFont.render(surface, str(self.label), BitmapFont.medium, tpos, Anchor.middle)
+        BitmapFont.render(surface, text, BitmapFont.medium, tpos, Anchor.middle)
+        return self.get_rect().union(BitmapFont.measure(text, BitmapFont.medium, tpos, Anchor.middle))
 
 
 class Dispatcher(object):
@@ -328,6 +528,11 @@ class Dispatcher(object):
         for listener in listeners:
             self.listeners.append(listener)
 
+        # the ui layer: the listeners are rendered into it only when they change
+        self.surface = None
+        self.bounds = None
+        self._drawn = {}
+
         # post an mouse motion event to update objects under the mouse
         # when the scene starts
         pos = pygame.mouse.get_pos()
@@ -378,6 +583,52 @@ class Dispatcher(object):
             if listener.active:
                 listener.on_keydown(keys, game)
 
+    def render(self, surface) -> None:
+        """Draws the listeners with a single blit of the ui layer.
+
+        Only the listeners marked as dirty, and the ones overlapping them, are
+        rendered again into the layer."""
+        size = Display.size()
+        if self.surface is None or self.surface.get_size() != size:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA)
+            self._drawn.clear()
+            for listener in self.listeners:
+                listener.dirty = True
+
+        dirty = [listener for listener in self.listeners if listener.dirty]
+        if dirty:
+            self._update_layer(dirty)
+
+        if self.bounds is not None:
+            surface.blit(self.surface, self.bounds.topleft, self.bounds)
+            Display.mark(surface, self.bounds)
+
+    def _update_layer(self, dirty: list) -> None:
+        drawn = self._drawn
+
+        # the areas to clear: where the dirty listeners were and where they will be
+        damage = []
+        for listener in dirty:
+            if listener in drawn:
+                damage.append(drawn.pop(listener))
+            damage.append(listener.get_rect())
+
+        for rect in damage:
+            self.surface.fill((0, 0, 0, 0), rect)
+
+        # render again, in order, everything touching the cleared areas
+        for listener in self.listeners:
+            if listener.dirty or (listener in drawn and drawn[listener].collidelist(damage) != -1):
+                rect = listener.basic_render(self.surface)
+                if rect is None:
+                    drawn.pop(listener, None)
+                else:
+                    drawn[listener] = rect
+                listener.dirty = False
+
+        rects = list(drawn.values())
+        self.bounds = rects[0].unionall(rects[1:]).clip(self.surface.get_rect()) if rects else None
+
 
 class Button(UIElement):
 